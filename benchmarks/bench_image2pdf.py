@@ -0,0 +1,81 @@
+"""
+Benchmark: streaming JPEG passthrough PDF writer vs Pillow's save_all path
+
+Each method runs in a fresh process so peak RSS is measured independently.
+Run from the repository root:
+    python -m benchmarks.bench_image2pdf [count] [width height]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from PIL import Image
+from services.pdf_writer import StreamingPdfWriter
+
+
+def pillow_pdf(image_paths, pdf_path):
+    """The original ImageToPdfHandler.create_pdf implementation"""
+    images = [Image.open(img).convert('RGB') for img in image_paths]
+    images[0].save(pdf_path, save_all=True, append_images=images[1:])
+
+
+def streaming_pdf(image_paths, pdf_path):
+    with StreamingPdfWriter(pdf_path) as writer:
+        for img in image_paths:
+            writer.add_image(img)
+
+
+METHODS = {'pillow': pillow_pdf, 'streaming': streaming_pdf}
+
+
+def measure(name, image_paths, pdf_path, results):
+    start = time.perf_counter()
+    METHODS[name](image_paths, pdf_path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((elapsed, peak_mb, os.path.getsize(pdf_path)))
+
+
+def make_images(directory, count, width, height):
+    paths = []
+    for i in range(count):
+        image = Image.effect_mandelbrot((width, height), (-2 + i * 0.01, -1.5, 1, 1.5), 80)
+        image = Image.merge('RGB', (image, image.rotate(180), Image.effect_noise((width, height), 40)))
+        path = os.path.join(directory, f"{i}.jpg")
+        image.save(path, 'JPEG', quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    width, height = (int(v) for v in sys.argv[2:4]) if len(sys.argv) >= 4 else (3000, 2000)
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Build the inputs in a child: ru_maxrss survives exec, so this
+        # process must stay small or both measurements inherit its peak
+        builder = ctx.Process(target=make_images, args=(tmp, count, width, height))
+        builder.start()
+        builder.join()
+        image_paths = [os.path.join(tmp, f"{i}.jpg") for i in range(count)]
+        input_mb = sum(os.path.getsize(p) for p in image_paths) / (1024 * 1024)
+        print(f"{count} JPEGs of {width}x{height}, {input_mb:.1f} MB in total")
+        for name in METHODS:
+            results = ctx.Queue()
+            process = ctx.Process(
+                target=measure, args=(name, image_paths, os.path.join(tmp, f"{name}.pdf"), results)
+            )
+            process.start()
+            elapsed, peak_mb, size = results.get()
+            process.join()
+            print(
+                f"{name:<10} time={elapsed:7.2f}s peak_rss={peak_mb:8.1f}MB "
+                f"output={size / (1024 * 1024):7.1f}MB"
+            )
+
+
+if __name__ == '__main__':
+    main()
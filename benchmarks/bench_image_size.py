@@ -0,0 +1,122 @@
+"""
+Micro-benchmark: predictive target-size search vs the old quality bisection
+
+Run from the repository root:
+    python -m benchmarks.bench_image_size [width height]
+"""
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+from PIL import Image, ImageFilter
+from services.image_service import ImageService
+
+TARGETS_KB = (100, 300, 400, 800, 2000)
+# The predictive search must land at least this close below the target,
+# unless quality 95 already fits
+MIN_FILL = 0.8
+
+
+class EncodeCounter:
+    """Count JPEG encodes by patching Image.save, split by full/proxy size"""
+
+    def __init__(self, full_pixels):
+        self.full_pixels = full_pixels
+        self.full = 0
+        self.small = 0
+
+    def __enter__(self):
+        self._save = Image.Image.save
+        counter = self
+
+        def save(image, *args, **kwargs):
+            if image.width * image.height >= counter.full_pixels // 4:
+                counter.full += 1
+            else:
+                counter.small += 1
+            return counter._save(image, *args, **kwargs)
+
+        Image.Image.save = save
+        return self
+
+    def __exit__(self, *exc):
+        Image.Image.save = self._save
+
+
+def bisect_quality(image, target_file_size, output_path):
+    """The original bisection from ImageService.process_image_size"""
+    min_quality = 1
+    max_quality = 95
+    best_output = None
+    best_quality = None
+
+    while min_quality <= max_quality:
+        quality = (min_quality + max_quality) // 2
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+        size_kb = output.tell() / 1024
+
+        if abs(size_kb - target_file_size) < 1 or max_quality - min_quality <= 1:
+            best_output = output
+            best_quality = quality
+            break
+        elif size_kb > target_file_size:
+            max_quality = quality - 1
+        else:
+            min_quality = quality + 1
+
+    if best_output is None:
+        return None, None, None
+    with open(output_path, 'wb') as f:
+        f.write(best_output.getvalue())
+    return output_path, best_quality, image.size
+
+
+def make_photo(width, height):
+    """Build a photo-like test image: smooth gradients plus sensor noise"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    red = Image.blend(gradient, noise, 0.3)
+    green = gradient.rotate(90).resize((width, height))
+    blue = Image.effect_mandelbrot((width, height), (-2, -1.5, 1, 1.5), 60)
+    image = Image.merge('RGB', (red, green, blue))
+    return image.filter(ImageFilter.SMOOTH)
+
+
+def run(label, func, image, target, output_path):
+    with EncodeCounter(image.width * image.height) as counter:
+        start = time.perf_counter()
+        path, quality, size = func(image, target, output_path)
+        elapsed = time.perf_counter() - start
+    actual = os.path.getsize(path) / 1024 if path else float('nan')
+    print(
+        f"{label:<10} target={target:>5}KB actual={actual:8.1f}KB "
+        f"q={quality} dims={size} full_encodes={counter.full} "
+        f"proxy_encodes={counter.small} time={elapsed * 1000:8.1f}ms"
+    )
+    return actual, quality
+
+
+def main():
+    width, height = (int(v) for v in sys.argv[1:3]) if len(sys.argv) >= 3 else (4000, 3000)
+    image = make_photo(width, height)
+    image.load()
+    service = ImageService()
+    short = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, 'out.jpg')
+        for target in TARGETS_KB:
+            run('bisection', bisect_quality, image, target, output_path)
+            actual, quality = run('predictive', service.process_image_size,
+                                  image, target, output_path)
+            if quality != 95 and not actual >= target * MIN_FILL:
+                short.append(target)
+    if short:
+        print(f"FAIL: predictive result below {MIN_FILL:.0%} of the target for {short} KB")
+        sys.exit(1)
+    print(f"OK: every predictive result reached {MIN_FILL:.0%} of its target")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: PyPDF2 vs PyMuPDF engines for split, merge and render
+
+Synthetic documents cover many small pages, large embedded images and many
+fonts. Each (document, engine, operation) runs in a fresh process so peak
+RSS is measured independently. Run from the repository root:
+    python -m benchmarks.bench_pdf_engines [pages]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from io import BytesIO
+import pymupdf
+from PIL import Image
+from services.pdf_service import ENGINES
+
+FONTS = ["helv", "heit", "hebo", "hebi", "tiro", "tiit", "tibo", "tibi",
+         "cour", "coit", "cobo", "cobi", "symb", "zadb"]
+
+
+def make_many_pages(path, pages):
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for line in range(40):
+            page.insert_text((50, 60 + line * 18), f"Page {i + 1}, line {line + 1}: lorem ipsum dolor sit amet")
+    doc.save(path, garbage=3, deflate=True)
+
+
+def make_big_images(path, pages):
+    doc = pymupdf.open()
+    for i in range(pages):
+        image = Image.effect_mandelbrot((3000, 2000), (-2 + i * 0.01, -1.5, 1, 1.5), 80)
+        image = Image.merge('RGB', (image, image.rotate(180), Image.effect_noise((3000, 2000), 40)))
+        data = BytesIO()
+        image.save(data, 'JPEG', quality=90)
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=data.getvalue())
+    doc.save(path)
+
+
+def make_many_fonts(path, pages):
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for line in range(40):
+            font = FONTS[(i + line) % len(FONTS)]
+            page.insert_text((50, 60 + line * 18), f"Page {i + 1} set in {font}", fontname=font)
+    doc.save(path, garbage=3, deflate=True)
+
+
+def split(engine, path, out_dir):
+    doc = engine.open(path)
+    try:
+        for page in range(engine.page_count(doc)):
+            engine.extract_pages(doc, [page], os.path.join(out_dir, f"{engine.name}_{page}.pdf"))
+    finally:
+        engine.close(doc)
+
+
+def merge(engine, path, out_dir):
+    engine.merge([path] * 5, os.path.join(out_dir, f"{engine.name}_merged.pdf"))
+
+
+def render(engine, path, out_dir):
+    doc = engine.open(path)
+    try:
+        for page in range(min(engine.page_count(doc), 20)):
+            engine.render(doc, page)
+    finally:
+        engine.close(doc)
+
+
+DOCUMENTS = {'many-pages': make_many_pages, 'big-images': make_big_images, 'many-fonts': make_many_fonts}
+OPERATIONS = {'split': split, 'merge': merge, 'render': render}
+
+
+def measure(engine_name, operation, path, out_dir, results):
+    engine = ENGINES[engine_name]()
+    start = time.perf_counter()
+    try:
+        OPERATIONS[operation](engine, path, out_dir)
+    except NotImplementedError:
+        results.put(None)
+        return
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((elapsed, peak_mb))
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for doc_name, make in DOCUMENTS.items():
+            path = os.path.join(tmp, f"{doc_name}.pdf")
+            # Image pages are large; keep that document short. Build it in a
+            # child too: ru_maxrss survives exec, so this process must stay small
+            count = pages if doc_name != 'big-images' else max(1, pages // 10)
+            builder = ctx.Process(target=make, args=(path, count))
+            builder.start()
+            builder.join()
+            print(f"{doc_name}: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+            for operation in OPERATIONS:
+                for engine_name in ENGINES:
+                    out_dir = tempfile.mkdtemp(dir=tmp)
+                    results = ctx.Queue()
+                    process = ctx.Process(
+                        target=measure, args=(engine_name, operation, path, out_dir, results)
+                    )
+                    process.start()
+                    result = results.get()
+                    process.join()
+                    if result is None:
+                        print(f"  {operation:<7} {engine_name:<8} not supported")
+                        continue
+                    elapsed, peak_mb = result
+                    print(f"  {operation:<7} {engine_name:<8} time={elapsed:7.2f}s peak_rss={peak_mb:8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,12 +8,13 @@ from handlers.help_handler import HelpHandler
 from handlers.image_handler import ImageHandler
 from handlers.image2pdf_handler import ImageToPdfHandler
 from handlers.cancel_handler import CancelHandler
-from handlers.unarchive_handler import start_unarchive, handle_archive
+from handlers.unarchive_handler import start_unarchive, handle_archive, handle_archive_callback
 from handlers.splitpdf_handler import SplitPdfHandler
 from handlers.pdf2image_handler import PdfToImageHandler
 from handlers.mergepdf_handler import MergePdfHandler
 from handlers.fileconverter_handler import FileConverterHandler
 from utils.logging_utils import setup_logging
+from utils.executor_utils import shutdown_executors
 
 from webserver import run_flask  # Import the Flask web server function
 from threading import Thread  # For running Flask in a separate thread
@@ -62,7 +63,9 @@ class Bot:
         @self.app.on_callback_query()
         async def callback(client, callback_query):
             chat_id = callback_query.message.chat.id
-            if chat_id in self.image_handler.user_settings:
+            if callback_query.data.startswith("arc:"):
+                await handle_archive_callback(client, callback_query)
+            elif chat_id in self.image_handler.user_settings:
                 await self.image_handler.handle_callback(client, callback_query)
             else:
                 await self.file_converter_handler.handle_callback(client, callback_query)
@@ -144,8 +147,12 @@ class Bot:
         flask_thread = Thread(target=run_flask)
         flask_thread.start()
         
-        # Run the bot
-        self.app.run()
+        # Run the bot; stop the worker pools once it exits
+        try:
+            self.app.run()
+        finally:
+            logger.info("Bot stopped, shutting down worker pools...")
+            shutdown_executors()
 
 if __name__ == "__main__":
     bot = Bot()
@@ -25,9 +25,76 @@ ALLOWED_IMAGE_TYPES = ['jpeg', 'jpg', 'png']
 # Configure maximum file sizes (in bytes)
 MAX_FILE_SIZE = 200 * 1024 * 1024  # 200MB
 
+# Configure /resizeimage dimension changes: "fast" decodes JPEGs at reduced
+# scale and pre-shrinks with reduce(), "quality" resamples the full image
+RESIZE_MODE = os.getenv("RESIZE_MODE", "fast")
+RESIZE_REDUCING_GAP = float(os.getenv("RESIZE_REDUCING_GAP", 3.0))
+
+# Inputs/outputs up to this size are processed in memory instead of on disk
+IN_MEMORY_THRESHOLD = int(os.getenv("IN_MEMORY_THRESHOLD", 10 * 1024 * 1024))  # 10MB
+
+# Configure per-chat session limits
+SESSION_TTL = int(os.getenv("SESSION_TTL", 30 * 60))  # 30 minutes since last use
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 500))  # per handler
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 256 * 1024 * 1024))  # all sessions
+
+# Configure the result cache (Telegram file_ids of already uploaded outputs)
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+RESULT_CACHE_PATH = os.path.join(CACHE_DIR, "results.sqlite3")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 5000))
+RESULT_CACHE_MAX_AGE = int(os.getenv("RESULT_CACHE_MAX_AGE", 30 * 24 * 3600))  # 30 days
+
+# Concurrent downloads per /image2pdf and /mergepdf handler
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 4))
+
+# Concurrent uploads per /unarchive job, and how often its status message is edited
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", 3.0))  # seconds
+
+# Pages prepared ahead of the one being uploaded by /splitpdf and /pdf2image
+PAGE_LOOKAHEAD = int(os.getenv("PAGE_LOOKAHEAD", 3))
+
+# PDF library used per operation: "pymupdf" or "pypdf2" (rendering needs pymupdf)
+PDF_ENGINES = {
+    'split': os.getenv("PDF_ENGINE_SPLIT", "pymupdf"),
+    'merge': os.getenv("PDF_ENGINE_MERGE", "pymupdf"),
+    'render': os.getenv("PDF_ENGINE_RENDER", "pymupdf"),
+}
+
+# /pdf2image renders documents with at least PDF_PARALLEL_MIN_PAGES selected
+# pages on a dedicated pool of PDF_RENDER_WORKERS processes (separate from
+# PROCESS_WORKERS), PDF_RENDER_CHUNK pages per job
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 16))
+PDF_RENDER_CHUNK = int(os.getenv("PDF_RENDER_CHUNK", 4))
+
+# /mergepdf limits; the PyMuPDF merge holds one input at a time, so these can be generous
+MERGE_MAX_FILE_SIZE = int(os.getenv("MERGE_MAX_FILE_SIZE", 50 * 1024 * 1024))  # 50MB
+MERGE_MAX_TOTAL_SIZE = int(os.getenv("MERGE_MAX_TOTAL_SIZE", 500 * 1024 * 1024))  # 500MB
+
+# ZIP output is split into volumes below Telegram's 2000 MiB upload limit
+ZIP_VOLUME_SIZE = int(os.getenv("ZIP_VOLUME_SIZE", 1900 * 1024 * 1024))
+
+# /unarchive reads the archive index from at most this many bytes of the
+# file before falling back to a full download, and lists this many items per page
+ARCHIVE_INDEX_MAX_FETCH = int(os.getenv("ARCHIVE_INDEX_MAX_FETCH", 16 * 1024 * 1024))
+ARCHIVE_LIST_PAGE_SIZE = int(os.getenv("ARCHIVE_LIST_PAGE_SIZE", 8))
+
+# /unarchive budgets, checked against the archive headers and again while extracting
+ARCHIVE_MAX_TOTAL_SIZE = int(os.getenv("ARCHIVE_MAX_TOTAL_SIZE", 4 * 1024 * 1024 * 1024))  # 4GB
+ARCHIVE_MAX_ENTRY_SIZE = int(os.getenv("ARCHIVE_MAX_ENTRY_SIZE", 2000 * 1024 * 1024))  # Telegram's upload limit
+ARCHIVE_MAX_RATIO = float(os.getenv("ARCHIVE_MAX_RATIO", 100))  # uncompressed / compressed
+ARCHIVE_MAX_ENTRIES = int(os.getenv("ARCHIVE_MAX_ENTRIES", 10000))
+ARCHIVE_MAX_DEPTH = int(os.getenv("ARCHIVE_MAX_DEPTH", 20))  # folders per member path
+
 # Configure timeout settings (in seconds)
 OPERATION_TIMEOUT = 300  # 5 minutes
 
 # Configure logging
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
+
+# Configure compute executors
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", os.cpu_count() or 2))
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
@@ -28,7 +28,7 @@ class CancelHandler:
             # Check if there's an active PDF operation
             pdf_cancelled = False
             if self.pdf_handler and chat_id in self.pdf_handler.user_images:
-                self.pdf_handler.cleanup_user_data(chat_id)
+                await self.pdf_handler.cleanup_user_data(chat_id)
                 pdf_cancelled = True
 
             # Check if there's an active PDF split operation
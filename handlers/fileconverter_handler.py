@@ -7,12 +7,37 @@ import os
 import logging
 import traceback
 from typing import Optional
+from utils.executor_utils import run_in_process
+from utils.file_utils import named_buffer
+from utils.session_utils import SessionStore
+
+
+def convert_pdf_to_word(pdf_path, output_path):
+    """Convert a PDF to a Word document (runs in a worker process)"""
+    cv = Converter(pdf_path)
+    try:
+        cv.convert(output_path)
+    finally:
+        cv.close()
+
+
+def convert_pdf_to_excel(pdf_path, output_path):
+    """Extract PDF tables into an Excel workbook and return the table count"""
+    tables = camelot.read_pdf(pdf_path, pages='all')
+    if not tables:
+        raise Exception("No tables found in PDF")
+    with pd.ExcelWriter(output_path) as writer:
+        for i, table in enumerate(tables):
+            df = table.df
+            df.to_excel(writer, sheet_name=f'Table_{i+1}', index=False)
+    return len(tables)
+
 
 class FileConverterHandler:
     def __init__(self):
         self.pdf_expected = {}
         self.txt_expected = {}
-        self.current_pdf = {}
+        self.current_pdf = SessionStore("fileconv", on_evict=self._remove_pdf)
         self.base_path = os.path.join("Downloads", "FileConverter")
         os.makedirs(self.base_path, exist_ok=True)
         logging.basicConfig(level=logging.INFO)
@@ -24,12 +49,15 @@ class FileConverterHandler:
         return folder
 
     def cleanup_user_data(self, chat_id):
-        if chat_id in self.current_pdf:
-            if os.path.exists(self.current_pdf[chat_id]):
-                os.remove(self.current_pdf[chat_id])
-            del self.current_pdf[chat_id]
-        self.pdf_expected[chat_id] = False
-        self.txt_expected[chat_id] = False
+        pdf_path = self.current_pdf.pop(chat_id, None)
+        if pdf_path is not None:
+            self._remove_pdf(chat_id, pdf_path)
+        self.pdf_expected.pop(chat_id, None)
+        self.txt_expected.pop(chat_id, None)
+
+    def _remove_pdf(self, chat_id, pdf_path):
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
 
     async def start_conversion(self, client: Client, message: Message):
         keyboard = InlineKeyboardMarkup([
@@ -65,32 +93,8 @@ class FileConverterHandler:
                         status_message = await callback_query.message.reply_text(
                             "Starting conversion... ⏳"
                         )
-                        
-                        class ProgressHandler:
-                            def __init__(self, status_message):
-                                self.status_message = status_message
-                            
-                            async def update(self, message):
-                                await self.status_message.edit_text(f"{message} ⏳")
-    
-                        progress = ProgressHandler(status_message)
-                        cv = Converter(pdf_path)
-                        
-                        # Monkey patch the logging
-                        original_info = self.logger.info
-                        async def new_info(msg):
-                            original_info(msg)
-                            if any(x in msg for x in ["Opening", "Analyzing", "Parsing", "Creating"]):
-                                await progress.update(msg)
-                        self.logger.info = new_info
-                        
-                        try:
-                            cv.convert(output_path)
-                        finally:
-                            self.logger.info = original_info
-                        
-                        cv.close()
-                        
+                        await run_in_process(convert_pdf_to_word, pdf_path, output_path)
+
                         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                             await status_message.edit_text("Sending converted file... 📤")
                             await callback_query.message.reply_document(
@@ -119,16 +123,9 @@ class FileConverterHandler:
                         status_message = await callback_query.message.reply_text(
                             "Converting PDF to Excel... ⏳"
                         )
-                        tables = camelot.read_pdf(pdf_path, pages='all')
-                        if not tables:
-                            raise Exception("No tables found in PDF")
-                        
                         await status_message.edit_text("Processing tables... ⚙️")
-                        with pd.ExcelWriter(output_path) as writer:
-                            for i, table in enumerate(tables):
-                                df = table.df
-                                df.to_excel(writer, sheet_name=f'Table_{i+1}', index=False)
-                        
+                        await run_in_process(convert_pdf_to_excel, pdf_path, output_path)
+
                         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                             await status_message.edit_text("Sending converted file... 📤")
                             await callback_query.message.reply_document(
@@ -172,7 +169,7 @@ class FileConverterHandler:
                          InlineKeyboardButton("Excel", callback_data="excel")]
                     ])
                     await message.reply_text("Choose the output format:", reply_markup=keyboard)
-                    self.pdf_expected[chat_id] = False
+                    self.pdf_expected.pop(chat_id, None)
                 except Exception as e:
                     self.logger.error(f"PDF handling error: {str(e)}\n{traceback.format_exc()}")
                     await message.reply_text(
@@ -188,12 +185,10 @@ class FileConverterHandler:
             status_message = await message.reply_text("Processing your text... ⏳")
             try:
                 text = message.text
-                output_path = os.path.join(self.get_user_folder(chat_id), "message.txt")
-                with open(output_path, "w", encoding='utf-8') as f:
-                    f.write(text)
+                text_file = named_buffer("message.txt", text.encode('utf-8'))
                 await status_message.edit_text("Text file created! Sending... 📤")
                 await message.reply_document(
-                    output_path,
+                    text_file,
                     caption="Here's your text file 📝"
                 )
             except Exception as e:
@@ -202,7 +197,5 @@ class FileConverterHandler:
                     "Sorry, there was an error creating your text file. Please try again. 🚫"
                 )
             finally:
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-                self.txt_expected[chat_id] = False
+                self.txt_expected.pop(chat_id, None)
                 await status_message.delete()
@@ -12,10 +12,17 @@ class HelpHandler:
             "<b>📑 PDF Operations:</b>\n"
             "• <b>/mergepdf</b> - Merge multiple PDF files into one 📚\n"
             "• <b>/splitpdf</b> - Split a PDF into individual pages ✂️\n"
+            "   <code>/splitpdf 1-5,9,20-</code> selected pages, <code>/splitpdf every 10</code> 10-page parts\n"
             "• <b>/pdf2image</b> - Convert a PDF to images (reply to a PDF file) 🖼️\n"
+            "   <code>/pdf2image 1-5,9</code> converts only the selected pages\n"
+            "   <code>/pdf2image jpeg q=80 dpi=150 gray</code> sets format (png, jpeg, webp), "
+            "quality, resolution (dpi=N or max=PIXELS) and grayscale\n"
+            "   <code>/pdf2image preview</code> shows thumbnails of the pages on a few contact sheets\n"
+            "   Add <code>zip</code> to /splitpdf or /pdf2image to get one ZIP file instead of many messages\n"
             "• <b>/fileconv</b> - Convert PDFs to Word/Excel or create a text file 📄\n\n"
             "<b>📦 Unarchive Operations:</b>\n"
-            "• <b>/unarchive</b> - Extract compressed files (zip, rar, 7z) 📂\n\n"
+            "• <b>/unarchive</b> - Extract compressed files (zip, rar, 7z) 📂\n"
+            "   Pick the files or folders you want from the listing, or extract everything\n\n"
             "<b>🎨 Image Operations:</b>\n"
             "• <b>/resizeimage</b> - Resize an image 🔄\n"
             "• <b>/image2pdf</b> - Convert images into a PDF 📄\n\n"
@@ -1,22 +1,29 @@
 import os
 import re
-from PIL import Image
+import asyncio
 from pyrogram import Client, filters
 from utils.logging_utils import setup_logging
+from utils.executor_utils import run_in_executor
+from utils.session_utils import SessionStore
+from services.pdf_writer import StreamingPdfWriter, prepare_image
+from utils.progress_utils import ProgressReporter
+from config.settings import DOWNLOAD_CONCURRENCY, PDF_DIR
 
 logger = setup_logging()
 
 class ImageToPdfHandler:
     def __init__(self):
-        self.user_images = {}
+        self.user_images = SessionStore("image2pdf", on_evict=self._clear_session)
         self.user_pdf_name = {}
         # Add state tracking
         self.waiting_for_images = {}
         self.waiting_for_name = {}
+        self.download_semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
 
     def get_user_dir(self, chat_id):
         """Create and return a user-specific directory"""
-        user_dir = os.path.join("Downloads", "PDF", str(chat_id))
+        # Absolute, since pyrogram resolves relative download paths against its own directory
+        user_dir = os.path.join(PDF_DIR, str(chat_id))
         os.makedirs(user_dir, exist_ok=True)
         return user_dir
 
@@ -27,7 +34,11 @@ class ImageToPdfHandler:
         logger.info(f"Starting PDF creation for chat_id: {chat_id}")
         
         # Initialize user state
-        self.user_images[chat_id] = []
+        self.user_images[chat_id] = {
+            'entries': [],
+            'status_reporters': {},
+            'status_lock': asyncio.Lock(),
+        }
         self.waiting_for_images[chat_id] = True
         self.waiting_for_name[chat_id] = False
         
@@ -45,36 +56,72 @@ class ImageToPdfHandler:
     
         user_dir = self.get_user_dir(chat_id)
         try:
-            file_path = None
             if message.photo:
                 # Handle photo message
-                file_path = await message.download()
                 file_extension = ".jpg"
             elif message.document:
                 # Handle document message
                 mime_type = message.document.mime_type
-                if mime_type.startswith("image/"):
-                    file_path = await message.download()
-                    file_extension = os.path.splitext(message.document.file_name)[1].lower()
+                if mime_type and mime_type.startswith("image/"):
+                    file_extension = os.path.splitext(message.document.file_name or "")[1].lower()
                     if file_extension not in [".jpg", ".jpeg", ".png", ".gif"]:
                         file_extension = ".jpg"  # Default to .jpg if extension is not recognized
                 else:
                     await message.reply_text("Please send only image files.")
                     return
-            
-            if not file_path:
+            else:
                 await message.reply_text("Please send an image or an image file (jpg, jpeg, png, gif).")
                 return
-    
-            new_file_name = f"{len(self.user_images[chat_id])}{file_extension}"
-            new_file_path = os.path.join(user_dir, new_file_name)
-            os.rename(file_path, new_file_path)
-            self.user_images[chat_id].append(new_file_path)
-            await message.reply_text(f"Received image {len(self.user_images[chat_id])}. Send more or type 'go'.")
+
+            # Reserve the page slot now so pages keep arrival order
+            session = self.user_images[chat_id]
+            index = len(session['entries'])
+            entry = {
+                'path': os.path.join(user_dir, f"{index}{file_extension}"),
+                'page_path': os.path.join(user_dir, f"{index}.page"),
+                'prepared': None,
+                'error': None,
+            }
+            session['entries'].append(entry)
+            entry['task'] = asyncio.create_task(self._ingest(message, entry))
+            await self._acknowledge(message, session)
         except Exception as e:
             logger.error(f"Error processing image/document: {str(e)}")
             await message.reply_text(f"Error processing image/document: {str(e)}")
 
+    async def _ingest(self, message, entry):
+        """Download an image into the session dir and pre-build its page"""
+        try:
+            async with self.download_semaphore:
+                entry['path'] = await message.download(file_name=entry['path'])
+            entry['prepared'] = await run_in_executor(
+                prepare_image, entry['path'], entry['page_path']
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error preparing image {entry['path']}: {str(e)}")
+            entry['error'] = str(e)
+
+    async def _acknowledge(self, message, session):
+        """Keep one edited status message per album instead of a reply per image"""
+        group = message.media_group_id or message.id
+        count = len(session['entries'])
+        async with session['status_lock']:
+            reporter = session['status_reporters'].get(group)
+            if reporter is None:
+                status = await message.reply_text(self._received_text(count))
+                session['status_reporters'][group] = ProgressReporter(
+                    status, "Receiving images", unit='images',
+                    formatter=lambda r: self._received_text(r.current)
+                )
+                return
+        await reporter.update(count)
+
+    @staticmethod
+    def _received_text(count):
+        return f"Received {count} image{'s' if count > 1 else ''}. Send more or type 'go'."
+
 
 
     async def handle_go_command(self, client, message):
@@ -82,7 +129,7 @@ class ImageToPdfHandler:
         chat_id = message.chat.id
         logger.info(f"Received go command for chat_id: {chat_id}")
         
-        if chat_id not in self.user_images or not self.user_images[chat_id]:
+        if chat_id not in self.user_images or not self.user_images[chat_id]['entries']:
             await message.reply_text("You haven't sent any images yet.")
             return
             
@@ -121,32 +168,52 @@ class ImageToPdfHandler:
         chat_id = message.chat.id
         logger.info(f"Creating PDF for chat_id: {chat_id}")
         
-        if chat_id not in self.user_images or not self.user_images[chat_id]:
+        if chat_id not in self.user_images or not self.user_images[chat_id]['entries']:
             await message.reply_text("You haven't sent any images yet.")
             return
     
+        pdf_path = None
         try:
             pdf_filename = self.user_pdf_name.get(chat_id, "images.pdf")
             pdf_filename = os.path.basename(pdf_filename)  # Ensure only the filename is used
             user_dir = self.get_user_dir(chat_id)
             pdf_path = os.path.join(user_dir, pdf_filename)
     
-            images = [Image.open(img).convert('RGB') for img in self.user_images[chat_id]]
-            total_pages = len(images)
-            images[0].save(pdf_path, save_all=True, append_images=images[1:])
+            # Pages were pre-built as images arrived; wait for stragglers only.
+            # /cancel cancels these tasks, which is the only way they can fail
+            entries = list(self.user_images[chat_id]['entries'])
+            results = await asyncio.gather(*(entry['task'] for entry in entries), return_exceptions=True)
+            if any(isinstance(result, asyncio.CancelledError) for result in results):
+                return
+            prepared = [entry['prepared'] for entry in entries if entry['prepared'] is not None]
+            skipped = len(entries) - len(prepared)
+            if not prepared:
+                raise Exception("none of the images could be read")
+
+            total_pages = await run_in_executor(self.build_pdf, prepared, pdf_path)
     
             with open(pdf_path, 'rb') as pdf_file:
                 await client.send_document(chat_id, pdf_file, file_name=pdf_filename)  # Use pdf_filename here
     
             # Cleanup
             await self.cleanup_user_data(chat_id, pdf_path)
-            await message.reply_text(f"Your PDF has been created and sent! It contains {total_pages} pages.")
+            await message.reply_text(
+                f"Your PDF has been created and sent! It contains {total_pages} pages."
+                + (f"\n{skipped} unreadable image(s) were skipped." if skipped else "")
+            )
             
         except Exception as e:
             logger.error(f"Error creating PDF: {str(e)}")
             await message.reply_text(f"Error creating PDF: {str(e)}")
             await self.cleanup_user_data(chat_id, pdf_path)
 
+    @staticmethod
+    def build_pdf(prepared_images, pdf_path):
+        """Assemble pre-built pages into a PDF one page at a time and return the page count"""
+        with StreamingPdfWriter(pdf_path) as writer:
+            for prepared in prepared_images:
+                writer.add_prepared(prepared)
+            return writer.page_count
 
     async def handle_cancel(self, client, message):
         """Handle cancel command to clean up and stop the process"""
@@ -158,25 +225,41 @@ class ImageToPdfHandler:
 
     async def cleanup_user_data(self, chat_id, pdf_path=None):
         """Clean up user data and files"""
-        if chat_id in self.user_images:
-            user_dir = self.get_user_dir(chat_id)
-            for img in self.user_images[chat_id]:
-                try:
-                    os.remove(img)
-                except OSError:
-                    pass
-            try:
-                os.rmdir(user_dir)
-            except OSError:
-                pass
-            del self.user_images[chat_id]
+        session = self.user_images.pop(chat_id, None)
+        if session is not None:
+            self._clear_session(chat_id, session)
+        else:
+            self._clear_state(chat_id)
         
         if pdf_path and os.path.exists(pdf_path):
             try:
                 os.remove(pdf_path)
             except OSError:
                 pass
-            
+
+    def _clear_session(self, chat_id, session):
+        """Remove a session's images and state; also used when a session expires"""
+        # Absolute, since pyrogram resolves relative download paths against its own directory
+        user_dir = os.path.join(PDF_DIR, str(chat_id))
+        # Cancel pending edits and drop the reporters from /metrics
+        for reporter in session['status_reporters'].values():
+            reporter.stop()
+        for entry in session['entries']:
+            if entry.get('task'):
+                entry['task'].cancel()
+            for path in (entry['path'], entry['page_path']):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        try:
+            os.rmdir(user_dir)
+        except OSError:
+            pass
+        self._clear_state(chat_id)
+
+    def _clear_state(self, chat_id):
+        """Forget the naming and collection state of a chat"""
         if chat_id in self.user_pdf_name:
             del self.user_pdf_name[chat_id]
             
@@ -2,10 +2,19 @@
 Handler for image-related commands
 """
 from pyrogram import Client, filters
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 from PIL import Image
 from services.image_service import ImageService
-from utils.file_utils import get_user_folder, cleanup_user_data
+from utils.file_utils import (
+    get_user_folder, cleanup_user_data, download_input, named_buffer,
+    is_buffer, source_size, source_exists, remove_source
+)
+from utils.executor_utils import run_in_executor
+from utils.session_utils import SessionStore
+from services.result_cache import result_cache, cached_item, reply_from_cache
+from config.settings import RESIZE_MODE
+from io import BytesIO
+import asyncio
 import os
 import logging
 
@@ -14,69 +23,133 @@ logger = logging.getLogger(__name__)
 class ImageHandler:
     def __init__(self):
         self.image_service = ImageService()
-        self.user_settings = {}
+        # Sessions keep the encoded originals (bytes or paths), never decoded pixels
+        self.user_settings = SessionStore(
+            "resize",
+            on_evict=self._evict_session,
+            sizeof=lambda session: sum(
+                len(original.get('data') or b'') for original in session['originals']
+            ),
+        )
+
+    def _evict_session(self, chat_id, session):
+        """Delete files of a session dropped by the session store"""
+        for original_path in session.get('original_paths', []):
+            if os.path.exists(original_path):
+                os.remove(original_path)
+
+    def open_original(self, original):
+        """Lazily reopen one of the session's original images"""
+        if original.get('data') is not None:
+            return Image.open(BytesIO(original['data']))
+        return Image.open(original['path'])
+
+    async def _get_photos(self, client, message):
+        """Return the replied photo, or every photo of the replied album"""
+        replied = message.reply_to_message
+        if replied.media_group_id:
+            try:
+                album = await client.get_media_group(message.chat.id, replied.id)
+                photos = [item.photo for item in album if item.photo]
+                if photos:
+                    return photos
+            except Exception as e:
+                logger.error(f"Error fetching media group: {e}")
+        photo = replied.photo
+        if isinstance(photo, list):
+            photo = photo[-1]  # Get the highest resolution if it's a list
+        return [photo]
 
     async def handle_resize_image(self, client, message):
         """Handle the /resizeimage command"""
         try:
             chat_id = message.chat.id
-    
+
             # Verify command and image
             if not message.reply_to_message or not message.reply_to_message.photo:
                 await message.reply_text("Please reply to an image with the /resizeimage command.")
                 return
-    
+
             # Download and process image
-            await message.reply_text("Processing your image...")
-            photo = message.reply_to_message.photo
-            if isinstance(photo, list):
-                photo = photo[-1]  # Get the highest resolution if it's a list
-    
+            photos = await self._get_photos(client, message)
+            await message.reply_text(
+                "Processing your image..." if len(photos) == 1
+                else f"Processing {len(photos)} images..."
+            )
+
             # Ensure directories exist
             user_folder = os.path.join("Downloads", "Resize", str(chat_id))
             os.makedirs(user_folder, exist_ok=True)
-    
-            downloaded_file = await client.download_media(photo, file_name=os.path.join(user_folder, "original_image.jpg"))
-    
+
+            downloaded_files = await asyncio.gather(*(
+                download_input(
+                    client, photo, photo.file_size,
+                    os.path.join(user_folder, f"original_image_{i}.jpg")
+                )
+                for i, photo in enumerate(photos)
+            ))
+
             try:
-                image = Image.open(downloaded_file)
-    
                 # Store user session data
-                self.user_settings[chat_id] = {
+                session = {
                     'command_state': 'choose_modification',
-                    'image': image,
                     'user_folder': user_folder,
-                    'original_path': downloaded_file,
+                    'originals': [],
+                    'original_paths': [],
                 }
-    
+                sizes = []
+                for photo, downloaded_file in zip(photos, downloaded_files):
+                    # Only the header is read here; pixels are decoded when processing
+                    with Image.open(downloaded_file) as image:
+                        sizes.append(image.size)
+                    original = {'file_unique_id': photo.file_unique_id}
+                    if is_buffer(downloaded_file):
+                        original['data'] = downloaded_file.getvalue()
+                    else:
+                        original['path'] = downloaded_file
+                        session['original_paths'].append(downloaded_file)
+                    session['originals'].append(original)
+                self.user_settings[chat_id] = session
+
                 # Prepare image details
-                file_size_mb = os.path.getsize(downloaded_file) / (1024 * 1024)
-                file_size_kb = os.path.getsize(downloaded_file) / 1024
-                image_details = (
-                    f"Image Details:\n\n"
-                    f"File Size: {file_size_mb:.2f} MB ({file_size_kb:.2f} KB)\n"
-                    f"Dimensions: {image.width}x{image.height}px"
-                )
-    
+                total_size = sum(source_size(downloaded_file) for downloaded_file in downloaded_files)
+                file_size_mb = total_size / (1024 * 1024)
+                file_size_kb = total_size / 1024
+                if len(photos) == 1:
+                    image_details = (
+                        f"Image Details:\n\n"
+                        f"File Size: {file_size_mb:.2f} MB ({file_size_kb:.2f} KB)\n"
+                        f"Dimensions: {sizes[0][0]}x{sizes[0][1]}px"
+                    )
+                else:
+                    image_details = (
+                        f"Album Details:\n\n"
+                        f"Images: {len(photos)}\n"
+                        f"Total Size: {file_size_mb:.2f} MB ({file_size_kb:.2f} KB)\n"
+                        f"Dimensions: " + ", ".join(f"{w}x{h}" for w, h in sizes) + "px\n\n"
+                        "The chosen setting will be applied to every image."
+                    )
+
                 # Create inline keyboard
                 markup = InlineKeyboardMarkup([
                     [InlineKeyboardButton(text="Modify File Size", callback_data="modify_file_size")],
                     [InlineKeyboardButton(text="Modify Dimensions", callback_data="modify_file_dimensions")],
+                    [InlineKeyboardButton(text="Target Visual Quality", callback_data="modify_quality")],
                     [InlineKeyboardButton(text="Cancel", callback_data="cancel")]
                 ])
-    
+
                 await message.reply_text(
                     f"{image_details}\n\nPlease choose a modification option:",
                     reply_markup=markup
                 )
-    
+
             except Exception as e:
                 logger.error(f"Error processing image: {e}")
                 await message.reply_text("Error processing the image. Please try again with a different image.")
                 cleanup_user_data(chat_id, self.user_settings)
-                if os.path.exists(downloaded_file):
-                    os.remove(downloaded_file)
-    
+                for downloaded_file in downloaded_files:
+                    remove_source(downloaded_file)
+
         except Exception as e:
             logger.error(f"Error in handle_resize_image: {e}")
             await message.reply_text("An error occurred while processing your request.")
@@ -112,6 +185,13 @@ class ImageHandler:
                 )
                 self.user_settings[chat_id]['command_state'] = 'enter_dimensions'
 
+            elif data == "modify_quality":
+                await callback_query.message.reply_text(
+                    "Please enter the minimum visual similarity to the original (SSIM, 0-1).\n"
+                    "For example: 0.95 for the smallest file that still looks nearly identical"
+                )
+                self.user_settings[chat_id]['command_state'] = 'enter_quality'
+
             await callback_query.answer()
 
         except Exception as e:
@@ -135,19 +215,75 @@ class ImageHandler:
 
             command_state = self.user_settings[chat_id]['command_state']
             user_folder = self.user_settings[chat_id]['user_folder']
-            image = self.user_settings[chat_id]['image']
 
             if command_state == 'enter_file_size':
-                await self._handle_file_size(message, chat_id, image, user_folder)
+                await self._handle_file_size(client, message, chat_id, user_folder)
             elif command_state == 'enter_dimensions':
-                await self._handle_dimensions(message, chat_id, image, user_folder)
+                await self._handle_dimensions(client, message, chat_id, user_folder)
+            elif command_state == 'enter_quality':
+                await self._handle_quality(client, message, chat_id, user_folder)
 
         except Exception as e:
             logger.error(f"Error in handle_text: {e}")
             await message.reply_text("An error occurred while processing your request.")
             cleanup_user_data(chat_id, self.user_settings)
 
-    async def _handle_file_size(self, message, chat_id, image, user_folder):
+    def _output_target(self, original, user_folder, index):
+        """Return an in-memory buffer for in-memory originals, else an output path"""
+        if original.get('data') is not None:
+            return named_buffer(f'resized_image_{index}.jpg')
+        return os.path.join(user_folder, f'resized_image_{index}.jpg')
+
+    def _cache_key(self, chat_id, operation, **params):
+        originals = self.user_settings[chat_id]['originals']
+        file_unique_id = ",".join(original['file_unique_id'] for original in originals)
+        return result_cache.make_key(file_unique_id, operation, **params)
+
+    def _resize_to_size(self, original, target_file_size, output_path):
+        """Reopen one original and encode it to the target size (executor job)"""
+        with self.open_original(original) as image:
+            return self.image_service.process_image_size(image, target_file_size, output_path)
+
+    def _resize_to_quality(self, original, min_ssim, output_path):
+        """Reopen one original and find the smallest JPEG meeting min_ssim (executor job)"""
+        with self.open_original(original) as image:
+            output_path, quality, achieved = self.image_service.process_image_quality(
+                image, min_ssim, output_path
+            )
+            return output_path, quality, achieved, image.size
+
+    def _resize_to_dimensions(self, original, width, height, output_path):
+        """Reopen one original and fit it into width x height (executor job)"""
+        with self.open_original(original) as image:
+            output_path = self.image_service.process_image_dimensions(
+                image, width, height, output_path
+            )
+        with Image.open(output_path) as resized_image:
+            resized_size = resized_image.size
+        if is_buffer(output_path):
+            output_path.seek(0)
+        return output_path, resized_size
+
+    async def _process_all(self, chat_id, user_folder, job, *args):
+        """Run job(original, *args, output) for every original concurrently"""
+        originals = self.user_settings[chat_id]['originals']
+        return await asyncio.gather(*(
+            run_in_executor(job, original, *args, self._output_target(original, user_folder, i))
+            for i, original in enumerate(originals)
+        ))
+
+    async def _send_results(self, client, message, outputs, captions):
+        """Send one photo, or all photos as a single media group"""
+        if len(outputs) == 1:
+            sent = [await message.reply_photo(photo=outputs[0], caption=captions[0])]
+        else:
+            sent = await client.send_media_group(
+                message.chat.id,
+                [InputMediaPhoto(output, caption=caption) for output, caption in zip(outputs, captions)]
+            )
+        return [cached_item(item, caption) for item, caption in zip(sent, captions)]
+
+    async def _handle_file_size(self, client, message, chat_id, user_folder):
         """Handle file size modification"""
         try:
             target_file_size = float(message.text.strip())
@@ -155,32 +291,36 @@ class ImageHandler:
                 await message.reply_text("Please enter a positive file size.")
                 return
 
-            output_path = os.path.join(user_folder, 'resized_image.jpg')
+            cache_key = self._cache_key(chat_id, "resize_size", kb=target_file_size)
+            results = []
 
             try:
-                output_path, quality = self.image_service.process_image_size(
-                    image, target_file_size, output_path
+                if await reply_from_cache(client, chat_id, cache_key):
+                    return
+
+                results = await self._process_all(
+                    chat_id, user_folder, self._resize_to_size, target_file_size
                 )
 
-                if output_path is None or not os.path.exists(output_path):
+                if not all(source_exists(output_path) for output_path, _, _ in results):
                     await message.reply_text("Couldn't achieve the target file size. Please try a larger size.")
                     return
 
-                # Send the processed image
-                await message.reply_photo(
-                    photo=output_path,
-                    caption=(
-                        f"Resized Image Details:\n"
-                        f"File Size: {os.path.getsize(output_path) / 1024:.2f} KB\n"
-                        f"Quality: {quality}%\n"
-                        f"Dimensions: {image.width}x{image.height}px"
-                    )
-                )
+                # Send the processed images
+                captions = [
+                    f"Resized Image Details:\n"
+                    f"File Size: {source_size(output_path) / 1024:.2f} KB\n"
+                    f"Quality: {quality}%\n"
+                    f"Dimensions: {dimensions[0]}x{dimensions[1]}px"
+                    for output_path, quality, dimensions in results
+                ]
+                outputs = [output_path for output_path, _, _ in results]
+                result_cache.put(cache_key, await self._send_results(client, message, outputs, captions))
 
             finally:
                 # Cleanup
-                if output_path and os.path.exists(output_path):
-                    os.remove(output_path)
+                for output_path, _, _ in results:
+                    remove_source(output_path)
                 cleanup_user_data(chat_id, self.user_settings)
 
         except ValueError:
@@ -189,7 +329,50 @@ class ImageHandler:
                 "For example: 500 for 500KB"
             )
 
-    async def _handle_dimensions(self, message, chat_id, image, user_folder):
+    async def _handle_quality(self, client, message, chat_id, user_folder):
+        """Handle perceptual quality target"""
+        try:
+            min_ssim = float(message.text.strip())
+            if not 0 < min_ssim < 1:
+                raise ValueError(min_ssim)
+        except ValueError:
+            await message.reply_text(
+                "Invalid quality target. Please enter a number between 0 and 1.\n"
+                "For example: 0.95"
+            )
+            return
+
+        cache_key = self._cache_key(chat_id, "resize_quality", ssim=min_ssim)
+        results = []
+
+        try:
+            if await reply_from_cache(client, chat_id, cache_key):
+                return
+
+            results = await self._process_all(
+                chat_id, user_folder, self._resize_to_quality, min_ssim
+            )
+
+            captions = [
+                f"Resized Image Details:\n"
+                f"File Size: {source_size(output_path) / 1024:.2f} KB\n"
+                f"Quality: {quality}% (SSIM {achieved:.3f})\n"
+                f"Dimensions: {dimensions[0]}x{dimensions[1]}px"
+                for output_path, quality, achieved, dimensions in results
+            ]
+            outputs = [output_path for output_path, _, _, _ in results]
+            result_cache.put(cache_key, await self._send_results(client, message, outputs, captions))
+
+        except Exception as e:
+            logger.error(f"Error processing quality target: {e}")
+            await message.reply_text("Error processing the quality target. Please try again.")
+
+        finally:
+            for output_path, _, _, _ in results:
+                remove_source(output_path)
+            cleanup_user_data(chat_id, self.user_settings)
+
+    async def _handle_dimensions(self, client, message, chat_id, user_folder):
         """Handle dimension modification"""
         try:
             # Parse dimensions
@@ -206,34 +389,37 @@ class ImageHandler:
                 await message.reply_text("Please enter positive dimensions.")
                 return
 
-            output_path = os.path.join(user_folder, 'resized_image.jpg')
+            cache_key = self._cache_key(
+                chat_id, "resize_dimensions", width=width, height=height, mode=RESIZE_MODE
+            )
+            results = []
 
             try:
-                # Process the image and save the resized version
-                with image as img:  # Use a context manager to ensure the file is properly closed
-                    output_path = self.image_service.process_image_dimensions(
-                        img, width, height, output_path
-                    )
+                if await reply_from_cache(client, chat_id, cache_key):
+                    return
 
-                if output_path is None or not os.path.exists(output_path):
+                # Process the images and save the resized versions
+                results = await self._process_all(
+                    chat_id, user_folder, self._resize_to_dimensions, width, height
+                )
+
+                if not all(source_exists(output_path) for output_path, _ in results):
                     await message.reply_text("Error processing image dimensions. Please try different dimensions.")
                     return
 
-                # Open and send the resized image
-                with Image.open(output_path) as resized_image:
-                    await message.reply_photo(
-                        photo=output_path,
-                        caption=(
-                            f"Resized Image Details:\n"
-                            f"File Size: {os.path.getsize(output_path) / 1024:.2f} KB\n"
-                            f"Dimensions: {resized_image.width}x{resized_image.height}px"
-                        )
-                    )
+                captions = [
+                    f"Resized Image Details:\n"
+                    f"File Size: {source_size(output_path) / 1024:.2f} KB\n"
+                    f"Dimensions: {resized_size[0]}x{resized_size[1]}px"
+                    for output_path, resized_size in results
+                ]
+                outputs = [output_path for output_path, _ in results]
+                result_cache.put(cache_key, await self._send_results(client, message, outputs, captions))
 
             finally:
-                # Cleanup: Ensure file is properly closed and removed
-                if os.path.exists(output_path):
-                    os.remove(output_path)
+                # Cleanup: Ensure files are removed
+                for output_path, _ in results:
+                    remove_source(output_path)
                 cleanup_user_data(chat_id, self.user_settings)
 
         except Exception as e:
@@ -247,10 +433,10 @@ def cleanup_user_data(chat_id, user_settings):
         if chat_id in user_settings:
             user_data = user_settings[chat_id]
 
-            # Remove original image file
-            original_path = user_data.get("original_path")
-            if original_path and os.path.exists(original_path):
-                os.remove(original_path)
+            # Remove original image files
+            for original_path in user_data.get("original_paths", []):
+                if os.path.exists(original_path):
+                    os.remove(original_path)
 
             # Delete user folder if empty
             user_folder = user_data.get("user_folder")
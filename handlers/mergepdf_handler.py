@@ -1,12 +1,29 @@
 import os
 import re
-from PyPDF2 import PdfMerger
+import asyncio
 from pyrogram import Client, filters
+from utils.logging_utils import setup_logging
+from utils.executor_utils import run_in_executor
+from utils.file_utils import download_input, fits_in_memory, is_buffer, named_buffer, remove_source, source_size
+from utils.session_utils import SessionStore
+from utils.progress_utils import ProgressReporter
+from services.pdf_service import get_pdf_engine
+from config.settings import DOWNLOAD_CONCURRENCY, MERGE_MAX_FILE_SIZE, MERGE_MAX_TOTAL_SIZE
+
+logger = setup_logging()
 
 class MergePdfHandler:
     def __init__(self):
-        self.merge_sessions = {}
+        # Small PDFs are kept in memory until the merge; count them against the session budget
+        self.merge_sessions = SessionStore(
+            "mergepdf",
+            on_evict=self._remove_session_files,
+            sizeof=lambda session: sum(
+                source_size(pdf['source']) for pdf in session['pdfs_received'] if is_buffer(pdf['source'])
+            ),
+        )
         self.base_path = os.path.join("Downloads", "Mergepdf")
+        self.download_semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
         os.makedirs(self.base_path, exist_ok=True)
 
     def get_user_folder(self, chat_id):
@@ -24,27 +41,55 @@ class MergePdfHandler:
         return cleaned
 
     def cleanup_user_data(self, chat_id):
-        if chat_id in self.merge_sessions:
-            session = self.merge_sessions[chat_id]
-            folder_path = session.get('folder_path')
-            if folder_path and os.path.exists(folder_path):
-                for file in os.listdir(folder_path):
-                    try:
-                        os.remove(os.path.join(folder_path, file))
-                    except Exception as e:
-                        print(f"Error removing file: {e}")
-            del self.merge_sessions[chat_id]
+        session = self.merge_sessions.pop(chat_id, None)
+        if session is not None:
+            self._remove_session_files(chat_id, session)
+
+    def _remove_session_files(self, chat_id, session):
+        if session.get('status_reporter') is not None:
+            session['status_reporter'].stop()
+        for pdf in session.get('pdfs_received', []):
+            if pdf.get('task'):
+                pdf['task'].cancel()
+            pdf['source'] = None
+        folder_path = session.get('folder_path')
+        if folder_path and os.path.exists(folder_path):
+            for file in os.listdir(folder_path):
+                try:
+                    os.remove(os.path.join(folder_path, file))
+                except Exception as e:
+                    print(f"Error removing file: {e}")
+
+    def merge_files(self, file_paths, output_path):
+        get_pdf_engine("merge").merge(file_paths, output_path)
+
+    @staticmethod
+    def inspect_pdf(source):
+        """Open a downloaded PDF and return its page count, or raise ValueError if unusable"""
+        engine = get_pdf_engine("merge")
+        doc = engine.open(source)
+        try:
+            if engine.is_encrypted(doc):
+                raise ValueError("it is password protected")
+            page_count = engine.page_count(doc)
+            if not page_count:
+                raise ValueError("it has no pages")
+            return page_count
+        finally:
+            engine.close(doc)
 
     async def start_merge(self, client, message):
         chat_id = message.chat.id
+        self.cleanup_user_data(chat_id)
         self.merge_sessions[chat_id] = {
             'pdfs_received': [],
-            'status_messages': [],
+            'status_reporter': None,
+            'status_lock': asyncio.Lock(),
             'in_progress': True,
             'folder_path': self.get_user_folder(chat_id)
         }
         await message.reply_text(
-            "Please send the PDFs one by one (maximum 10 files, 20MB each).\n"
+            f"Please send the PDFs one by one (maximum 50 files, {MERGE_MAX_FILE_SIZE // (1024 * 1024)}MB each).\n"
             "When finished, you can either:\n"
             "• Send 'DONE' to merge with default filename\n"
             "• Send any other text to use as the merged file's name"
@@ -65,35 +110,90 @@ class MergePdfHandler:
             return
 
         file_size = message.document.file_size
-        if file_size > 5 * 1024 * 1024:
-            await message.reply_text("❌ File size exceeds the limit of 5 MB")
+        if file_size > MERGE_MAX_FILE_SIZE:
+            await message.reply_text(f"❌ File size exceeds the limit of {MERGE_MAX_FILE_SIZE // (1024 * 1024)} MB")
+            return
+
+        received_size = sum(pdf['file_size'] for pdf in session['pdfs_received'])
+        if received_size + file_size > MERGE_MAX_TOTAL_SIZE:
+            await message.reply_text(
+                f"❌ This file would take the total over {MERGE_MAX_TOTAL_SIZE // (1024 * 1024)} MB. "
+                "Send 'DONE' or filename to merge what you have."
+            )
             return
 
         if len(session['pdfs_received']) >= 50:
             await message.reply_text("❌ Maximum file limit of 50 reached. Send 'DONE' or filename to merge.")
             return
 
+        # Reserve the slot now so files keep arrival order, then download in the background
+        index = len(session['pdfs_received'])
         file_info = {
             'file_id': message.document.file_id,
-            'file_name': message.document.file_name or f"document_{len(session['pdfs_received']) + 1}.pdf",
-            'file_size': file_size
+            'file_name': message.document.file_name or f"document_{index + 1}.pdf",
+            'file_size': file_size,
+            'source': None,
+            'pages': None,
+            'error': None,
         }
         session['pdfs_received'].append(file_info)
+        file_path = os.path.join(session['folder_path'], f"temp_{index}.pdf")
+        file_info['task'] = asyncio.create_task(
+            self._ingest(client, message, session, file_info, file_path)
+        )
+        await self._update_status(message, session)
 
-        if session['status_messages']:
+    async def _ingest(self, client, message, session, file_info, file_path):
+        """Download one PDF and check that it can be merged"""
+        try:
+            async with self.download_semaphore:
+                file_info['source'] = await download_input(
+                    client, message.document, file_info['file_size'], file_path
+                )
+            file_info['pages'] = await run_in_executor(self.inspect_pdf, file_info['source'])
+            self.merge_sessions.touch(message.chat.id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reason = str(e) if isinstance(e, ValueError) else "it could not be read"
+            logger.error(f"Error checking PDF {file_info['file_name']}: {e}")
+            file_info['error'] = reason
+            remove_source(file_info['source'])
+            file_info['source'] = None
             try:
-                await client.delete_messages(chat_id, session['status_messages'][-1].message_id)
-                session['status_messages'].pop()
+                await message.reply_text(f"❌ {file_info['file_name']} will be skipped: {reason}.")
             except Exception:
                 pass
+        if session['in_progress']:
+            await self._update_status(message, session)
+
+    async def _update_status(self, message, session):
+        """Edit a single status message in place instead of re-sending the file list"""
+        pdfs = session['pdfs_received']
+        ready = sum(1 for pdf in pdfs if pdf['pages'] is not None or pdf['error'] is not None)
+        async with session['status_lock']:
+            reporter = session['status_reporter']
+            if reporter is None:
+                status = await message.reply_text(self._status_text(session))
+                session['status_reporter'] = ProgressReporter(
+                    status, "Receiving PDFs", len(pdfs), unit='files',
+                    formatter=lambda r: self._status_text(session)
+                )
+                return
+        await reporter.update(ready, total=len(pdfs))
 
-        count = len(session['pdfs_received'])
-        reply = await message.reply_text(
-            f"✅ {count} PDF{'s' if count > 1 else ''} received:\n" +
-            "\n".join(f"{i + 1}. {pdf['file_name']}" for i, pdf in enumerate(session['pdfs_received'])) +
-            "\n\nSend more PDFs, 'DONE' for default filename, or send custom filename for the merged PDF."
+    @staticmethod
+    def _status_text(session):
+        pdfs = session['pdfs_received']
+        count = len(pdfs)
+        ready = sum(1 for pdf in pdfs if pdf['pages'] is not None)
+        failed = sum(1 for pdf in pdfs if pdf['error'] is not None)
+        return (
+            f"✅ {count} PDF{'s' if count > 1 else ''} received, {ready} ready"
+            + (f", {failed} skipped" if failed else "")
+            + f" (last: {pdfs[-1]['file_name']}).\n\n"
+            "Send more PDFs, 'DONE' for default filename, or send custom filename for the merged PDF."
         )
-        session['status_messages'].append(reply)
 
     async def handle_merge_complete(self, client, message):
         chat_id = message.chat.id
@@ -112,33 +212,44 @@ class MergePdfHandler:
             return
 
         total_size = sum(pdf['file_size'] for pdf in session['pdfs_received'])
-        if total_size > 100 * 1024 * 1024:
-            await message.reply_text("❌ Total file size exceeds 100 MB limit.")
+        if total_size > MERGE_MAX_TOTAL_SIZE:
+            await message.reply_text(f"❌ Total file size exceeds {MERGE_MAX_TOTAL_SIZE // (1024 * 1024)} MB limit.")
             self.cleanup_user_data(chat_id)
             return
 
         output_filename = 'merged.pdf' if message.text.strip().upper() == 'DONE' else self.clean_filename(message.text.strip())
         progress_msg = None
-        temp_files = []
 
         try:
             progress_msg = await message.reply_text("🔄 Merging PDFs...")
-            merger = PdfMerger()
 
-            for i, pdf in enumerate(session['pdfs_received']):
-                file_path = os.path.join(session['folder_path'], f"temp_{i}.pdf")
-                temp_files.append(file_path)
-                await client.download_media(pdf['file_id'], file_path)
-                merger.append(file_path)
+            # Files were downloaded and checked as they arrived; wait for stragglers only.
+            # /cancel cancels these tasks, which is the only way they can fail
+            results = await asyncio.gather(
+                *(pdf['task'] for pdf in session['pdfs_received']), return_exceptions=True
+            )
+            if any(isinstance(result, asyncio.CancelledError) for result in results):
+                return
+            if session['status_reporter'] is not None:
+                await session['status_reporter'].finish()
+            usable = [pdf for pdf in session['pdfs_received'] if pdf['source'] is not None]
+            skipped = len(session['pdfs_received']) - len(usable)
+            if not usable:
+                raise Exception("none of the PDFs could be read")
 
-            output_path = os.path.join(session['folder_path'], output_filename)
-            merger.write(output_path)
-            merger.close()
+            # Small merges never touch the disk
+            if fits_in_memory(total_size):
+                output_path = named_buffer(output_filename)
+            else:
+                output_path = os.path.join(session['folder_path'], output_filename)
+            await run_in_executor(self.merge_files, [pdf['source'] for pdf in usable], output_path)
 
+            total_pages = sum(pdf['pages'] for pdf in usable)
             await client.send_document(
                 chat_id,
                 output_path,
-                caption=f"✅ Successfully merged {len(session['pdfs_received'])} PDFs into '{output_filename}'!"
+                caption=f"✅ Successfully merged {len(usable)} PDFs ({total_pages} pages) into '{output_filename}'!"
+                + (f"\n{skipped} unreadable PDF(s) were skipped." if skipped else "")
             )
 
         except Exception as e:
@@ -151,4 +262,5 @@ class MergePdfHandler:
                 except Exception:
                     pass
 
-            self.cleanup_user_data(chat_id)
+            if self.merge_sessions.get(chat_id) is session:
+                self.cleanup_user_data(chat_id)
@@ -1,13 +1,39 @@
+import asyncio
 import os
-import pymupdf
+from collections import deque
 from pyrogram import Client, filters
-from utils.file_utils import create_user_folder
+from pyrogram.types import InputMediaDocument, InputMediaPhoto
+from utils.file_utils import (
+    create_user_folder, download_input, named_buffer, is_buffer, remove_source, spill_to_disk
+)
+from config.settings import (
+    PAGE_LOOKAHEAD, PDF_RENDER_WORKERS, PDF_PARALLEL_MIN_PAGES, PDF_RENDER_CHUNK
+)
+from utils.executor_utils import run_in_executor, run_in_render_process, iterate_in_executor, aenumerate
+from services.result_cache import result_cache, cached_item, reply_from_cache
+from utils.page_utils import PageSelectionError, parse_page_command, resolve_pages, chunk_pages
+from services.pdf_service import (
+    get_pdf_engine, RenderOptions, render_page_range, make_contact_sheets, sample_pages
+)
+from services.zip_writer import ZipVolumeWriter, upload_volume
+from utils.progress_utils import ProgressReporter
+from utils.logging_utils import setup_logging
+
+logger = setup_logging()
+
+ALBUM_SIZE = 10  # Telegram's media group limit
 
 class PdfToImageHandler:
     def __init__(self):
         self.user_pdfs = {}
+        self.engine = get_pdf_engine("render")
 
     async def handle_pdf_to_image(self, client, message):
+        status_message = None
+        reporter = None
+        pdf_path = None
+        pdf_document = None
+        zip_writer = None
         try:
             chat_id = message.chat.id
             
@@ -26,50 +52,202 @@ class PdfToImageHandler:
                 await message.reply_text("❌ The file must be a PDF document.")
                 return
 
+            try:
+                ranges, chunk_size, option_args = parse_page_command(message.command[1:])
+                if chunk_size:
+                    raise PageSelectionError("'every N' is only supported by /splitpdf")
+                modes = {arg.lower() for arg in option_args} & {'zip', 'preview'}
+                zip_mode, preview_mode = 'zip' in modes, 'preview' in modes
+                options = RenderOptions.parse([arg for arg in option_args if arg.lower() not in modes])
+            except ValueError as e:
+                await message.reply_text(
+                    f"❌ {e}.\n"
+                    "Usage: /pdf2image [pages] [png|jpeg|webp] [q=1-100] [dpi=N | max=PIXELS] [gray] [zip]\n"
+                    "       /pdf2image preview [pages]\n"
+                    "Example: /pdf2image 1-5,9,20- jpeg q=80 dpi=150"
+                )
+                return
+
             # Create user-specific folder
             user_folder = create_user_folder(chat_id, "Downloads/pdf2image")
 
-            # Rest of your code remains the same
-            pdf_path = await client.download_media(
-                message.reply_to_message.document, 
-                file_name=os.path.join(user_folder, message.reply_to_message.document.file_name)
+            document = message.reply_to_message.document
+            cache_key = result_cache.make_key(
+                document.file_unique_id, "pdf2image", pages=ranges, zip=zip_mode, **options.params()
             )
+            if preview_mode:
+                cache_key = result_cache.make_key(document.file_unique_id, "pdf2image_preview", pages=ranges)
+            if await reply_from_cache(client, chat_id, cache_key):
+                await message.reply_text("✅ PDF to image conversion completed.")
+                return
 
-            pdf_document = pymupdf.open(pdf_path)
-            total_pages = len(pdf_document)
+            status_message = await message.reply_text("📥 Downloading PDF file...")
+            download_reporter = ProgressReporter(status_message, "📥 Downloading PDF file...", document.file_size)
+            try:
+                pdf_path = await download_input(
+                    client,
+                    document,
+                    document.file_size,
+                    os.path.join(user_folder, document.file_name),
+                    progress=download_reporter.update
+                )
+            finally:
+                download_reporter.stop()
+
+            pdf_document = await run_in_executor(self.engine.open, pdf_path)
+            total_pages = self.engine.page_count(pdf_document)
+            try:
+                pages = resolve_pages(ranges, total_pages)
+            except PageSelectionError as e:
+                await status_message.edit_text(f"❌ {e}.")
+                return
 
-            status_message = await message.reply_text("Starting PDF to image conversion...")
+            if preview_mode:
+                await status_message.delete()
+                await self.send_preview(client, message, pdf_document, pages, total_pages, cache_key)
+                return
 
-            for i in range(total_pages):
-                page = pdf_document[i]
-                zoom = 2
-                mat = pymupdf.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat)
-                image_name = os.path.join(user_folder, f"page_{i + 1}.png")
-                pix.save(image_name)
+            reporter = ProgressReporter(
+                status_message,
+                "🗜 Converting and archiving pages..." if zip_mode else "📤 Converting and sending pages...",
+                len(pages),
+                unit='pages'
+            )
+            await reporter.update(0, force=True)
 
-                await status_message.edit_text(
-                    f"📤 Converting and sending page {i + 1}/{total_pages} ({((i + 1)/total_pages)*100:.1f}%)"
+            # Pages render in the background while the previous album uploads;
+            # at most one album plus the pages in flight wait in memory
+            if len(pages) >= PDF_PARALLEL_MIN_PAGES and PDF_RENDER_WORKERS > 1:
+                if is_buffer(pdf_path):
+                    # Workers open the file themselves; don't pickle the PDF into every job
+                    pdf_path = await run_in_executor(
+                        spill_to_disk, pdf_path, os.path.join(user_folder, document.file_name)
+                    )
+                rendered = self.render_pages_parallel(pdf_path, pages, options)
+            else:
+                rendered = iterate_in_executor(
+                    self.render_pages(pdf_document, pages, options), max(PAGE_LOOKAHEAD, ALBUM_SIZE)
                 )
 
-                await client.send_document(
-                    chat_id,
-                    image_name,
-                    caption=f"Page {i + 1} of {total_pages}"
-                )
+            sent_items = []
+            album = []
+            if zip_mode:
+                base_name = os.path.splitext(document.file_name)[0] or "pages"
+                zip_writer = ZipVolumeWriter(user_folder, base_name)
+            async for n, (i, image_file) in aenumerate(rendered):
+                last = n + 1 == len(pages)
+                if zip_mode:
+                    # Pages go straight into the archive; volumes upload as they fill up
+                    closed = await run_in_executor(zip_writer.add, image_file.name, image_file.getvalue())
+                    if closed:
+                        sent_items.append(await upload_volume(
+                            client, chat_id, closed, f"Part {zip_writer.volume_count - 1}"
+                        ))
+                    await reporter.update(n + 1)
+                    continue
 
-                if os.path.exists(image_name):
-                    os.remove(image_name)
+                album.append((image_file, f"Page {i + 1} of {total_pages}"))
+                if len(album) == ALBUM_SIZE or last:
+                    sent_items.extend(await self.send_album(client, chat_id, album))
+                    album = []
+                    await reporter.update(n + 1)
 
-            pdf_document.close()
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
+            if zip_mode:
+                closed = await run_in_executor(zip_writer.close)
+                if closed:
+                    caption = (f"Part {zip_writer.volume_count}" if zip_writer.volume_count > 1
+                               else f"{len(pages)} pages")
+                    sent_items.append(await upload_volume(client, chat_id, closed, caption))
+
+            result_cache.put(cache_key, sent_items)
             
+            await reporter.finish()
             await status_message.delete()
             await message.reply_text("✅ PDF to image conversion completed.")
 
         except Exception as e:
-            print(f"Error in handle_pdf_to_image: {e}")
-            await message.reply_text("❌ An error occurred during the PDF to image conversion.")
-            if 'pdf_document' in locals():
-                pdf_document.close()
+            logger.error(f"Error in handle_pdf_to_image: {e}")
+            if reporter:
+                reporter.stop()
+            if zip_writer:
+                zip_writer.discard()
+            error_text = "❌ An error occurred during the PDF to image conversion."
+            try:
+                if status_message:
+                    await status_message.edit_text(error_text)
+                else:
+                    await message.reply_text(error_text)
+            except Exception:
+                await message.reply_text(error_text)
+        finally:
+            if pdf_document is not None:
+                self.engine.close(pdf_document)
+            remove_source(pdf_path)
+
+    def render_pages(self, pdf_document, pages, options):
+        """Yield (index, named image buffer) for each page"""
+        for index in pages:
+            yield index, named_buffer(
+                f"page_{index + 1}.{options.extension}",
+                self.engine.render(pdf_document, index, options)
+            )
+
+    async def render_pages_parallel(self, pdf_path, pages, options):
+        """Render chunks of pages across the process pool, yielding (index, buffer) in page order.
+
+        Each job opens its own copy of the document on the render pool; at
+        most PDF_RENDER_WORKERS chunks are in flight at a time, one per worker.
+        """
+        chunks = deque(chunk_pages(pages, PDF_RENDER_CHUNK))
+        pending = deque()
+        try:
+            while chunks or pending:
+                while chunks and len(pending) < PDF_RENDER_WORKERS:
+                    chunk = chunks.popleft()
+                    pending.append((chunk, asyncio.ensure_future(
+                        run_in_render_process(render_page_range, pdf_path, chunk, options)
+                    )))
+                chunk, job = pending.popleft()
+                for index, data in zip(chunk, await job):
+                    yield index, named_buffer(f"page_{index + 1}.{options.extension}", data)
+        finally:
+            for _, job in pending:
+                job.cancel()
+
+    async def send_preview(self, client, message, pdf_document, pages, total_pages, cache_key):
+        """Send contact sheets of (a sample of) the selected pages as one album"""
+        shown = sample_pages(pages)
+        status_message = await message.reply_text(f"🔍 Rendering a preview of {len(shown)} pages...")
+        sheets = await run_in_executor(make_contact_sheets, self.engine, pdf_document, shown)
+
+        media = []
+        captions = []
+        for n, (data, sheet_pages) in enumerate(sheets):
+            first, last = sheet_pages[0] + 1, sheet_pages[-1] + 1
+            caption = f"Page {first} of {total_pages}" if first == last else f"Pages {first}-{last} of {total_pages}"
+            if n == 0 and len(shown) < len(pages):
+                caption += f" ({len(shown)} of {len(pages)} selected pages shown)"
+            media.append(named_buffer(f"preview_{n + 1}.jpg", data))
+            captions.append(caption)
+
+        if len(media) == 1:
+            sent = [await message.reply_photo(photo=media[0], caption=captions[0])]
+        else:
+            sent = await client.send_media_group(
+                message.chat.id,
+                [InputMediaPhoto(sheet, caption=caption) for sheet, caption in zip(media, captions)]
+            )
+        result_cache.put(cache_key, [cached_item(item, caption) for item, caption in zip(sent, captions)])
+        await status_message.delete()
+
+    async def send_album(self, client, chat_id, album):
+        """Send up to ALBUM_SIZE (file, caption) pairs as documents in one media group"""
+        if len(album) == 1:
+            image_file, caption = album[0]
+            sent = [await client.send_document(chat_id, image_file, caption=caption)]
+        else:
+            sent = await client.send_media_group(
+                chat_id,
+                [InputMediaDocument(image_file, caption=caption) for image_file, caption in album]
+            )
+        return [cached_item(item, caption) for item, (_, caption) in zip(sent, album)]
@@ -3,8 +3,17 @@ Handler for splitting PDF files
 """
 import os
 from pyrogram import filters
-from PyPDF2 import PdfReader, PdfWriter
 from utils.logging_utils import setup_logging
+from config.settings import PAGE_LOOKAHEAD
+from utils.page_utils import (
+    PageSelectionError, parse_page_command, resolve_pages, chunk_pages, describe_pages
+)
+from utils.executor_utils import run_in_executor, iterate_in_executor, aenumerate
+from utils.file_utils import download_input, named_buffer, source_exists
+from services.result_cache import result_cache, cached_item, reply_from_cache
+from services.pdf_service import get_pdf_engine
+from services.zip_writer import ZipVolumeWriter, upload_volume
+from utils.progress_utils import ProgressReporter
 
 logger = setup_logging()
 
@@ -42,26 +51,52 @@ class SplitPdfHandler:
             await message.reply_text("Sorry, the maximum file size allowed is 200 MB.")
             return
 
+        try:
+            ranges, chunk_size, other_args = parse_page_command(message.command[1:])
+            unknown = [arg for arg in other_args if arg.lower() != 'zip']
+            if unknown:
+                raise PageSelectionError(f"unknown option '{unknown[0]}'")
+        except PageSelectionError as e:
+            await message.reply_text(
+                f"❌ {e}.\n"
+                "Usage: /splitpdf [pages] [every N] [zip]\n"
+                "Examples: /splitpdf 1-5,9,20-  or  /splitpdf every 10 zip"
+            )
+            return
+        zip_mode = bool(other_args)
+
         if self.processing_status.get(chat_id, False):
             await message.reply_text(
                 "Sorry, another PDF file is currently being processed. Please wait or use /cancel."
             )
             return
 
+        cache_key = result_cache.make_key(
+            replied_document.file_unique_id, "splitpdf", pages=ranges, every=chunk_size, zip=zip_mode
+        )
+        if await reply_from_cache(client, chat_id, cache_key):
+            await client.send_message(chat_id, "✅ PDF splitting completed successfully!")
+            return
+
         user_dir = self.get_user_dir(chat_id)
         self.processing_status[chat_id] = True
         status_message = await message.reply_text("📥 Downloading PDF file...")
+        engine = pdf_document = zip_writer = None
         
         try:
             # Download file
             pdf_path = os.path.join(user_dir, f"{file_id}.pdf")
-            downloaded_file_path = await client.download_media(
-                replied_document,
-                file_name=pdf_path,
-                progress=lambda current, total: self.handle_progress(
-                    current, total, status_message, "Downloading"
+            download_reporter = ProgressReporter(status_message, "📥 Downloading PDF file...", file_size)
+            try:
+                pdf_source = await download_input(
+                    client,
+                    replied_document,
+                    file_size,
+                    pdf_path,
+                    progress=download_reporter.update
                 )
-            )
+            finally:
+                download_reporter.stop()
             
             if not self.processing_status.get(chat_id, False):
                 await status_message.edit_text("❌ Process cancelled by user.")
@@ -71,44 +106,75 @@ class SplitPdfHandler:
             await status_message.delete()
             status_message = await message.reply_text("📄 Analyzing PDF file...")
             
-            if os.path.exists(pdf_path):
-                # Read PDF and get total pages
-                pdf = PdfReader(pdf_path)
-                total_pages = len(pdf.pages)
+            if source_exists(pdf_source):
+                # Open the PDF once; the same document counts and splits the pages
+                engine = get_pdf_engine("split")
+                pdf_document = await run_in_executor(engine.open, pdf_source)
+                total_pages = engine.page_count(pdf_document)
+                if not total_pages:
+                    await status_message.edit_text("❌ Error: Could not split the PDF. It might be empty.")
+                    return
+        
+                try:
+                    pages = resolve_pages(ranges, total_pages)
+                except PageSelectionError as e:
+                    await status_message.edit_text(f"❌ {e}.")
+                    return
+                groups = chunk_pages(pages, chunk_size) if chunk_size else [[page] for page in pages]
         
                 # Delete the previous status message and create a new one
                 await status_message.delete()
-                status_message = await message.reply_text(f"📑 Found {total_pages} pages. Starting split process...")
-        
-                pages = self.split_pdf_pages(pdf_path)
-                if not pages:
-                    await status_message.edit_text("❌ Error: Could not split the PDF. It might be empty.")
-                    return
+                status_message = await message.reply_text(
+                    f"📑 Found {total_pages} pages. Splitting {len(pages)} page(s) "
+                    f"into {len(groups)} file(s)..."
+                )
         
-                for i, page in enumerate(pages):
+                # Parts are serialized on the executor while earlier ones upload
+                sent_items = []
+                reporter = ProgressReporter(
+                    status_message,
+                    "🗜 Archiving files..." if zip_mode else "📤 Sending files...",
+                    len(groups),
+                    unit='files',
+                    formatter=lambda r: (
+                        f"📑 Found {total_pages} pages. Splitting {len(pages)} page(s) into {len(groups)} file(s)...\n\n"
+                        + r.render_default()
+                    ),
+                )
+                if zip_mode:
+                    base_name = os.path.splitext(file_name)[0] or "pages"
+                    zip_writer = ZipVolumeWriter(user_dir, f"{base_name}_split")
+                async for i, (group, page_file) in aenumerate(iterate_in_executor(
+                    self.split_pdf_pages(engine, pdf_document, groups), PAGE_LOOKAHEAD
+                )):
                     if not self.processing_status.get(chat_id, False):
                         await status_message.edit_text("❌ PDF splitting cancelled.")
                         return
-                        
-                    page_name = os.path.join(user_dir, f"page_{i + 1}.pdf")
-                    with open(page_name, 'wb') as f:
-                        page.write(f)
                     
-                    # Delete the previous status message and create a new one
-                    await status_message.delete()
-                    status_message = await message.reply_text(
-                        f"📤 Sending page {i + 1}/{total_pages} ({((i + 1)/total_pages)*100:.1f}%)"
-                    )
-                    
-                    await client.send_document(
-                        chat_id,
-                        page_name,
-                        caption=f"Page {i + 1} of {total_pages}"
-                    )
-                    
-                    if os.path.exists(page_name):
-                        os.remove(page_name)
+                    if zip_mode:
+                        # Parts go straight into the archive; volumes upload as they fill up
+                        closed = await run_in_executor(zip_writer.add, page_file.name, page_file.getvalue())
+                        if closed:
+                            sent_items.append(await upload_volume(
+                                client, chat_id, closed, f"Part {zip_writer.volume_count - 1}"
+                            ))
+                        await reporter.update(i + 1)
+                        continue
+
+                    caption = f"Page{'s' if len(group) > 1 else ''} {describe_pages(group)} of {total_pages}"
+                    sent = await client.send_document(chat_id, page_file, caption=caption)
+                    sent_items.append(cached_item(sent, caption))
+                    await reporter.update(i + 1)
+
+                if zip_mode:
+                    closed = await run_in_executor(zip_writer.close)
+                    if closed:
+                        caption = (f"Part {zip_writer.volume_count}" if zip_writer.volume_count > 1
+                                   else f"{len(groups)} file(s) from {total_pages} pages")
+                        sent_items.append(await upload_volume(client, chat_id, closed, caption))
         
+                await reporter.finish()
+                result_cache.put(cache_key, sent_items)
                 await client.send_message(chat_id, "✅ PDF splitting completed successfully!")
             else:
                 await client.send_message(chat_id, "❌ Error: Failed to process the PDF file.")
@@ -122,34 +188,24 @@ class SplitPdfHandler:
             else:
                 await status_message.edit_text(f"❌ An error occurred: {error_message}")
         finally:
+            if pdf_document is not None:
+                await run_in_executor(engine.close, pdf_document)
+            if zip_writer is not None:
+                zip_writer.discard()
             self.cleanup_user_data(chat_id)
 
-    async def handle_progress(self, current, total, message, action):
-        try:
-            percent = (current * 100) / total
-            progress_text = f"{action}: {percent:.1f}%\n"
-            progress_text += self.create_progress_bar(percent)
-            await message.edit_text(progress_text)
-        except Exception as e:
-            logger.error(f"Error updating progress: {e}")
-
-    def create_progress_bar(self, percent):
-        completed = int(percent / 10)
-        remaining = 10 - completed
-        return f"[{'█' * completed}{'░' * remaining}]"
+    def split_pdf_pages(self, engine, pdf_document, groups):
+        """Yield (group, buffer) for each group of page indices, one at a time.
 
-    def split_pdf_pages(self, file_path):
-        try:
-            input_pdf = PdfReader(file_path)
-            pages = []
-            for i in range(len(input_pdf.pages)):
-                output = PdfWriter()
-                output.add_page(input_pdf.pages[i])
-                pages.append(output)
-            return pages
-        except Exception as e:
-            logger.error(f"Error splitting PDF: {e}")
-            return []
+        Only the selected pages are touched, and each chunk is written in a
+        single pass from the shared document.
+        """
+        for group in groups:
+            prefix = "page" if len(group) == 1 else "pages"
+            page_file = named_buffer(f"{prefix}_{describe_pages(group)}.pdf")
+            engine.extract_pages(pdf_document, group, page_file)
+            page_file.seek(0)
+            yield group, page_file
 
     def cleanup_user_data(self, chat_id):
         """Clean up user data and reset processing status"""
@@ -1,12 +1,22 @@
 from pyrogram import Client
-from pyrogram.types import Message
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 import os
 import time
-from typing import Tuple, List, Dict
-from pyunpack import Archive
+from typing import Tuple, List, Dict, Optional, Set
 import shutil
 import asyncio
+import functools
 from urllib.parse import unquote
+from utils.executor_utils import run_in_executor
+from utils.upload_utils import UploadPool
+from utils.session_utils import SessionStore
+from services.archive_service import (
+    ArchiveError, ArchiveBudget, ArchiveBudgetError, SparseFile, ZipReader,
+    chunk_runs, list_archive, open_archive
+)
+from utils.progress_utils import ProgressReporter, format_size
+from config.settings import ARCHIVE_INDEX_MAX_FETCH, ARCHIVE_LIST_PAGE_SIZE
 
 SUPPORTED_ARCHIVE_TYPES = {
     'application/zip', 'application/x-rar-compressed',
@@ -24,49 +34,16 @@ download_tasks: Dict[int, asyncio.Task] = {}
 async def start_unarchive(client: Client, message: Message):
     """Handler for /unarchive command"""
     await message.reply_text(
-        "Send me an archive file (ZIP/RAR/7Z) to extract.\n"
+        "Send me an archive file (ZIP/RAR/7Z) to extract. "
+        "You can then pick the files you want from its listing.\n"
         f"Maximum file size: {MAX_FILE_SIZE/(1024*1024*1024):.1f}GB\n"
         "Use /cancel to stop the extraction process."
     )
 
-async def progress_callback(current, total, status_msg, text, start_time):
-    try:
-        percentage = current * 100 / total
-        speed = current / (time.time() - start_time)
-        elapsed_time = round(time.time() - start_time)
-        
-        if speed > 0:
-            eta = round((total - current) / speed)
-        else:
-            eta = 0
-            
-        await status_msg.edit_text(
-            f"{text}\n"
-            f"Progress: {percentage:.1f}%\n"
-            f"Speed: {get_size_format(speed)}/s\n"
-            f"ETA: {format_time(eta)}\n"
-            f"Elapsed: {format_time(elapsed_time)}"
-        )
-    except:
-        pass
-
-def get_size_format(b):
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if b < 1024.0:
-            return f"{b:.2f} {unit}"
-        b /= 1024.0
-    return f"{b:.2f} TB"
-
-def format_time(seconds):
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    seconds = seconds % 60
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-
 def get_directory_structure_for_file(path: str, file_name: str) -> List[str]:
     """Get directory structure for specific file"""
     structure = []
-    rel_path = file_name.split(os.sep)
+    rel_path = file_name.split('/')
     current_path = ""
     
     for i, part in enumerate(rel_path):
@@ -77,30 +54,163 @@ def get_directory_structure_for_file(path: str, file_name: str) -> List[str]:
     
     return structure
 
-async def download_file(client, message, file_path, progress_args):
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def listing_items(entries) -> List[Tuple[str, bool, int]]:
+    """Folders and files of an archive as (path, is_folder, size), sorted by path"""
+    folders = {}
+    for entry in entries:
+        parts = entry.name.strip('/').split('/')
+        for depth in range(1, len(parts)):
+            folder = '/'.join(parts[:depth]) + '/'
+            folders[folder] = folders.get(folder, 0) + entry.size
+    items = [(name, True, size) for name, size in folders.items()]
+    items.extend((entry.name, False, entry.size) for entry in entries)
+    return sorted(items, key=lambda item: item[0])
+
+def selected_names(session) -> Set[str]:
+    """Names of the files picked directly or through a selected folder"""
+    picked = [session['items'][i] for i in session['selected']]
+    prefixes = tuple(name for name, is_folder, _ in picked if is_folder)
+    files = {name for name, is_folder, _ in picked if not is_folder}
+    return {
+        entry.name for entry in session['entries']
+        if entry.name in files or (prefixes and entry.name.startswith(prefixes))
+    }
+
+def listing_markup(session) -> InlineKeyboardMarkup:
+    items = session['items']
+    pages = max(1, -(-len(items) // ARCHIVE_LIST_PAGE_SIZE))
+    page = min(session['page'], pages - 1)
+    chosen = selected_names(session)
+    folders = tuple(items[i][0] for i in session['selected'] if items[i][1])
+    rows = []
+    for i in range(page * ARCHIVE_LIST_PAGE_SIZE, min(len(items), (page + 1) * ARCHIVE_LIST_PAGE_SIZE)):
+        name, is_folder, size = items[i]
+        picked = name in chosen or (bool(folders) and name.startswith(folders))
+        label = name if len(name) <= 40 else "…" + name[-39:]
+        rows.append([InlineKeyboardButton(
+            f"{'✅' if picked else '⬜'} {'📁' if is_folder else '📄'} {label} ({format_size(size)})",
+            callback_data=f"arc:t:{i}"
+        )])
+    if pages > 1:
+        rows.append([
+            InlineKeyboardButton("◀️", callback_data=f"arc:p:{(page - 1) % pages}"),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="arc:n"),
+            InlineKeyboardButton("▶️", callback_data=f"arc:p:{(page + 1) % pages}"),
+        ])
+    rows.append([
+        InlineKeyboardButton(f"📤 Extract selected ({len(chosen)})", callback_data="arc:x"),
+        InlineKeyboardButton("📦 Extract all", callback_data="arc:a"),
+    ])
+    rows.append([InlineKeyboardButton("❌ Cancel", callback_data="arc:c")])
+    return InlineKeyboardMarkup(rows)
+
+def listing_text(session) -> str:
+    entries = session['entries']
+    chosen = selected_names(session)
+    chosen_size = sum(entry.size for entry in entries if entry.name in chosen)
+    return (
+        f"📦 {session['file_name']}\n"
+        f"{len(entries)} files, {format_size(sum(entry.size for entry in entries))} uncompressed\n"
+        f"Selected: {len(chosen)} files ({format_size(chosen_size)})\n\n"
+        "Tap files or folders to select them, then extract the selection or everything."
+    )
+
+async def fetch_chunks(client, message, sparse, chunks, reporter=None):
+    """Stream the given chunks of the message's file into sparse, one request per run.
+
+    The reporter is stopped once the transfer ends so that no trailing edit
+    overwrites whatever the status message shows next.
+    """
+    fetched = 0
     try:
-        await message.download(
-            file_path,
-            progress=progress_callback,
-            progress_args=progress_args
-        )
-        return True
+        for first, count in chunk_runs(chunks):
+            index = first
+            async for data in client.stream_media(message, limit=count, offset=first):
+                sparse.write_chunk(index, data)
+                index += 1
+                fetched += len(data)
+                if reporter is not None:
+                    await reporter.update(fetched)
+    finally:
+        if reporter is not None:
+            reporter.stop()
+
+async def read_remote_index(client, message, sparse, status_msg):
+    """List the archive from the chunks holding its index.
+
+    The first and last chunks are fetched first (ZIP and 7z keep their index
+    at the end), then whatever chunks the reader turns out to need. Once more
+    than ARCHIVE_INDEX_MAX_FETCH bytes would be fetched, e.g. for RAR archives
+    with headers spread across the file, the whole file is downloaded instead.
+    """
+    await fetch_chunks(client, message, sparse, {0, sparse.chunk_count - 1})
+    while True:
+        sparse.missing = None
+        try:
+            return await run_in_executor(list_archive, sparse)
+        except Exception:
+            if not sparse.missing:
+                raise
+        if (len(sparse.present) + len(sparse.missing)) * sparse.chunk_size > ARCHIVE_INDEX_MAX_FETCH:
+            break
+        await fetch_chunks(client, message, sparse, sparse.missing)
+
+    missing = sparse.missing_chunks()
+    reporter = ProgressReporter(status_msg, "📥 Downloading archive...", len(missing) * sparse.chunk_size)
+    await fetch_chunks(client, message, sparse, missing, reporter)
+    return await run_in_executor(list_archive, sparse)
+
+async def run_cancellable(chat_id, coro):
+    """Run coro as the chat's cancellable transfer; returns (completed, result)"""
+    task = asyncio.create_task(coro)
+    download_tasks[chat_id] = task
+    try:
+        return True, await task
     except asyncio.CancelledError:
-        return False
+        if not task.cancelled():
+            raise
+        return False, None
+    finally:
+        if download_tasks.get(chat_id) is task:
+            del download_tasks[chat_id]
 
 def cleanup_extraction(chat_id: int):
     """Clean up temporary files and data"""
-    if chat_id in active_extractions:
-        data = active_extractions[chat_id]
-        try:
-            if os.path.exists(data['input_path']):
-                os.remove(data['input_path'])
-            if os.path.exists(data['extract_dir']):
-                shutil.rmtree(data['extract_dir'])
-        except Exception as e:
-            print(f"Cleanup error: {str(e)}")
-        finally:
-            del active_extractions[chat_id]
+    data = active_extractions.pop(chat_id, None) or pending_archives.pop(chat_id, None)
+    if data is not None:
+        discard_extraction(chat_id, data)
+
+def release_session(chat_id: int, session: Dict):
+    """Discard a listing session, leaving a newer one from the same chat in place"""
+    if pending_archives.get(chat_id) is session:
+        del pending_archives[chat_id]
+    discard_extraction(chat_id, session)
+
+def discard_extraction(chat_id: int, data: Dict):
+    try:
+        if data.get('pool') is not None:
+            data['pool'].cancel()
+        if data.get('members') is not None:
+            try:
+                data['members'].close()
+            except ValueError:
+                pass  # still running on the executor; closing the reader stops it
+        if data.get('reader') is not None:
+            data['reader'].close()
+        data['sparse'].close()
+        if os.path.exists(data['input_path']):
+            os.remove(data['input_path'])
+        if os.path.exists(data['extract_dir']):
+            shutil.rmtree(data['extract_dir'])
+    except Exception as e:
+        print(f"Cleanup error: {str(e)}")
+
+# Archives whose listing is waiting for the user's selection
+pending_archives = SessionStore("unarchive", on_evict=discard_extraction)
 
 async def cancel_extraction(chat_id: int) -> bool:
     """Cancel ongoing extraction process"""
@@ -108,8 +218,8 @@ async def cancel_extraction(chat_id: int) -> bool:
         download_tasks[chat_id].cancel()
         del download_tasks[chat_id]
         
-    if chat_id in active_extractions:
-        data = active_extractions[chat_id]
+    data = active_extractions.get(chat_id) or pending_archives.get(chat_id)
+    if data is not None:
         try:
             await data['status_msg'].edit_text("❌ Operation cancelled.")
         except:
@@ -119,7 +229,7 @@ async def cancel_extraction(chat_id: int) -> bool:
     return False
 
 async def handle_archive(client: Client, message: Message):
-    """Main handler for archive files"""
+    """Main handler for archive files: list the archive and let the user pick members"""
     if not message.document or message.document.mime_type not in SUPPORTED_ARCHIVE_TYPES:
         return
 
@@ -128,89 +238,203 @@ async def handle_archive(client: Client, message: Message):
     if message.document.file_size > MAX_FILE_SIZE:
         await message.reply_text("File is too large. Maximum size allowed is 2GB.")
         return
+    if chat_id in active_extractions:
+        await message.reply_text("An extraction is already running. Please wait or use /cancel.")
+        return
+    # A listing still being read for an earlier archive is replaced by this one
+    previous = download_tasks.get(chat_id)
+    if previous is not None:
+        previous.cancel()
+        await asyncio.gather(previous, return_exceptions=True)
+    cleanup_extraction(chat_id)
 
-    status_msg = await message.reply_text("📥 Downloading archive...")
+    status_msg = await message.reply_text("🔍 Reading archive index...")
     
     # Create unique directory for this extraction
-    extract_id = f"{message.from_user.id}_{int(time.time())}"
+    extract_id = f"{message.from_user.id}_{message.id}_{int(time.time())}"
     input_path = os.path.join(ARCHIVE_DIR, f"archive_{extract_id}{os.path.splitext(message.document.file_name)[1]}")
     extract_dir = os.path.join(ARCHIVE_DIR, f"extracted_{extract_id}")
     os.makedirs(extract_dir, exist_ok=True)
 
-    # Store extraction info
-    active_extractions[chat_id] = {
+    # Only the chunks the index lives in are fetched for now
+    session = {
+        'message': message,
+        'file_name': message.document.file_name,
         'input_path': input_path,
         'extract_dir': extract_dir,
-        'status_msg': status_msg
+        'status_msg': status_msg,
+        'sparse': SparseFile(input_path, message.document.file_size),
+        'entries': [],
+        'items': [],
+        'selected': set(),
+        'page': 0,
     }
+    pending_archives[chat_id] = session
 
     try:
-        # Create download task
-        download_task = asyncio.create_task(
-            download_file(client, message, input_path, 
-                        (status_msg, "Downloading archive...", time.time()))
+        completed, entries = await run_cancellable(
+            chat_id, read_remote_index(client, message, session['sparse'], status_msg)
         )
-        download_tasks[chat_id] = download_task
-        
-        # Wait for download to complete
-        download_success = await download_task
-
-        if not download_success:
+        if not completed:
             await status_msg.edit_text("❌ Download cancelled.")
-            cleanup_extraction(chat_id)
+            release_session(chat_id, session)
             return
+        if pending_archives.get(chat_id) is not session:
+            # Cancelled, or replaced by a newer archive that already discarded this one
+            return
+        if not entries:
+            await status_msg.edit_text("❌ The archive contains no files.")
+            release_session(chat_id, session)
+            return
+        ArchiveBudget().check_index(entries)
 
-        if chat_id not in active_extractions:
+        session['entries'] = entries
+        session['items'] = listing_items(entries)
+        await status_msg.edit_text(listing_text(session), reply_markup=listing_markup(session))
+
+    except ArchiveBudgetError as e:
+        await status_msg.edit_text(f"❌ Archive rejected: {str(e)}.")
+        release_session(chat_id, session)
+    except ArchiveError as e:
+        await status_msg.edit_text(f"❌ Extraction error: {str(e)}")
+        release_session(chat_id, session)
+    except Exception as e:
+        await status_msg.edit_text(f"❌ Error: {str(e)}")
+        release_session(chat_id, session)
+
+async def handle_archive_callback(client: Client, callback_query):
+    """Handle the arc: buttons of an archive listing"""
+    chat_id = callback_query.message.chat.id
+    session = pending_archives.get(chat_id)
+    if session is None or callback_query.message.id != session['status_msg'].id:
+        await callback_query.answer("This listing has expired. Please send the archive again.", show_alert=True)
+        return
+
+    action, _, value = callback_query.data[len("arc:"):].partition(':')
+    if action == 't':
+        index = int(value)
+        session['selected'] ^= {index}
+    elif action == 'p':
+        session['page'] = int(value)
+    elif action == 'n':
+        await callback_query.answer()
+        return
+    elif action == 'c':
+        await callback_query.answer()
+        await session['status_msg'].edit_text("❌ Operation cancelled.")
+        cleanup_extraction(chat_id)
+        return
+    elif action in ('x', 'a'):
+        names = None if action == 'a' else selected_names(session)
+        if names is not None and not names:
+            await callback_query.answer("Select at least one file or folder first.", show_alert=True)
             return
+        await callback_query.answer()
+        await extract_archive(client, chat_id, names)
+        return
 
-        await status_msg.edit_text("⚙️ Extracting files...")
-        
-        # Extract using pyunpack
+    await callback_query.answer()
+    try:
+        await session['status_msg'].edit_text(listing_text(session), reply_markup=listing_markup(session))
+    except MessageNotModified:
+        pass
+
+async def extract_archive(client: Client, chat_id: int, names: Optional[Set[str]]):
+    """Fetch what the chosen members need, then extract and send them one at a time"""
+    data = pending_archives.pop(chat_id, None)
+    if data is None:
+        return
+    active_extractions[chat_id] = data
+    message, status_msg, sparse = data['message'], data['status_msg'], data['sparse']
+    extract_dir = data['extract_dir']
+
+    try:
+        await status_msg.edit_text("⚙️ Preparing extraction...")
+        reader = await run_in_executor(open_archive, sparse)
+        data['reader'] = reader
+        entries = reader.files(names)
+
+        # Refuse from the headers before fetching anything else
+        budget = ArchiveBudget()
         try:
-            Archive(input_path).extractall(extract_dir)
-            extracted_files = []
-            for root, _, files in os.walk(extract_dir):
-                for file in files:
-                    rel_path = os.path.relpath(os.path.join(root, file), extract_dir)
-                    extracted_files.append(rel_path)
-        except Exception as e:
-            await status_msg.edit_text(f"❌ Extraction error: {str(e)}")
+            budget.check_selection(entries, sparse.size)
+        except ArchiveBudgetError as e:
+            await status_msg.edit_text(f"❌ Archive rejected: {str(e)}.")
             return
 
-        await status_msg.edit_text(f"📤 Sending {len(extracted_files)} files...")
+        # ZIP members can be fetched on their own; other formats need the whole file
+        ranges = reader.data_ranges(entries)
+        if ranges is None:
+            missing = sparse.missing_chunks()
+        else:
+            missing = sorted({chunk for start, end in ranges for chunk in sparse.chunks_for(start, end)})
+        if missing:
+            reporter = ProgressReporter(
+                status_msg,
+                "📥 Downloading selected files..." if ranges is not None else "📥 Downloading archive...",
+                len(missing) * sparse.chunk_size
+            )
+            completed, _ = await run_cancellable(
+                chat_id, fetch_chunks(client, message, sparse, missing, reporter)
+            )
+            if not completed:
+                await status_msg.edit_text("❌ Download cancelled.")
+                return
+        if chat_id not in active_extractions:
+            return
+        if sparse.is_complete() and not isinstance(reader, ZipReader):
+            # External tools and py7zr read a finished file from its path
+            reader.close()
+            reader = await run_in_executor(open_archive, data['input_path'])
+            data['reader'] = reader
+
+        await status_msg.edit_text(f"📤 Sending {len(entries)} files...")
 
-        for i, file_name in enumerate(extracted_files, 1):
+        # Members are extracted one at a time while up to UPLOAD_CONCURRENCY
+        # earlier ones upload; each file is deleted as soon as it is sent
+        reporter = ProgressReporter(status_msg, "📤 Sending files...", len(entries), unit='files')
+        pool = UploadPool(reporter=reporter)
+        data['pool'] = pool
+        members = reader.iter_extract(extract_dir, names, budget.meter(sparse.size))
+        data['members'] = members
+        while True:
+            try:
+                item = await run_in_executor(next, members, None)
+            except ArchiveBudgetError as e:
+                # Stop uploading too; the finally block frees the disk right away
+                pool.cancel()
+                await status_msg.edit_text(f"❌ Extraction stopped: {str(e)}.")
+                return
+            except ArchiveError as e:
+                await message.reply_text(f"❌ Extraction error: {str(e)}")
+                break
+            if item is None:
+                break
             if chat_id not in active_extractions:
                 return
+            entry, file_path = item
+
+            # Get file-specific directory structure
+            dir_structure = get_directory_structure_for_file(extract_dir, entry.name)
+            structure_text = "📂 File Location:\n" + "\n".join(dir_structure)
 
-            file_path = os.path.join(extract_dir, file_name)
-            if os.path.isfile(file_path):
-                try:
-                    # Get file-specific directory structure
-                    dir_structure = get_directory_structure_for_file(extract_dir, file_name)
-                    structure_text = "📂 File Location:\n" + "\n".join(dir_structure)
-
-                    # Delete previous status message
-                    await status_msg.delete()
-                    
-                    # Create new status message
-                    status_msg = await message.reply_text(f"📤 Sending file {i}/{len(extracted_files)}...")
-                    active_extractions[chat_id]['status_msg'] = status_msg
-
-                    await message.reply_document(
-                        file_path,
-                        caption=structure_text,
-                        progress=progress_callback,
-                        progress_args=(status_msg, f"Sending file {i}/{len(extracted_files)}...", time.time())
-                    )
-                except Exception as e:
-                    await message.reply_text(f"❌ Error sending {file_name}: {str(e)}")
+            await pool.submit(
+                functools.partial(message.reply_document, file_path, caption=structure_text),
+                size=entry.size,
+                label=entry.name,
+                on_done=functools.partial(remove_file, file_path)
+            )
+        await pool.join()
 
         if chat_id in active_extractions:
+            for name, error in pool.errors[:10]:
+                await message.reply_text(f"❌ Error sending {name}: {str(error)}")
+            await reporter.finish()
             await client.send_message(chat_id, "✅ Extraction complete!")
 
     except Exception as e:
         if chat_id in active_extractions:
             await status_msg.edit_text(f"❌ Error: {str(e)}")
     finally:
-        cleanup_extraction(chat_id)
+        if active_extractions.get(chat_id) is data:
+            cleanup_extraction(chat_id)
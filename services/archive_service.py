@@ -0,0 +1,504 @@
+# services/archive_service.py
+"""
+Native ZIP, 7z and RAR readers that extract one member at a time
+"""
+import io
+import os
+import queue
+import threading
+import zipfile
+import zlib
+import py7zr
+import rarfile
+from py7zr.exceptions import Bad7zFile
+from py7zr.io import Py7zIO, WriterFactory
+from config.settings import (
+    ARCHIVE_MAX_TOTAL_SIZE, ARCHIVE_MAX_ENTRY_SIZE, ARCHIVE_MAX_RATIO,
+    ARCHIVE_MAX_ENTRIES, ARCHIVE_MAX_DEPTH
+)
+
+COPY_CHUNK = 1024 * 1024
+SPARSE_CHUNK = 1024 * 1024  # Telegram streams files in 1 MiB chunks
+# Below this much output the compression ratio is not checked; small
+# archives of text legitimately compress very well
+RATIO_MIN_SIZE = 32 * 1024 * 1024
+
+class ArchiveError(Exception):
+    """Raised for archives that cannot be opened or extracted"""
+
+class ArchiveBudgetError(ArchiveError):
+    """Raised when an archive exceeds an extraction budget"""
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.0f} MB"
+
+class ArchiveBudget:
+    """Limits on what extracting an archive may cost.
+
+    check_index() and check_selection() reject archives from their headers;
+    meter() enforces the same limits on the bytes actually written, since
+    headers can lie.
+    """
+
+    def __init__(self, max_total=ARCHIVE_MAX_TOTAL_SIZE, max_entry_size=ARCHIVE_MAX_ENTRY_SIZE,
+                 max_ratio=ARCHIVE_MAX_RATIO, max_entries=ARCHIVE_MAX_ENTRIES, max_depth=ARCHIVE_MAX_DEPTH):
+        self.max_total = max_total
+        self.max_entry_size = max_entry_size
+        self.max_ratio = max_ratio
+        self.max_entries = max_entries
+        self.max_depth = max_depth
+
+    def check_index(self, entries):
+        """Check the number of members and how deeply they are nested"""
+        if len(entries) > self.max_entries:
+            raise ArchiveBudgetError(
+                f"it has {len(entries)} files, more than the limit of {self.max_entries}"
+            )
+        for entry in entries:
+            depth = entry.name.strip('/').count('/')
+            if depth > self.max_depth:
+                raise ArchiveBudgetError(
+                    f"{entry.name} is nested {depth} folders deep, more than the limit of {self.max_depth}"
+                )
+
+    def check_selection(self, entries, archive_size):
+        """Check the declared sizes and compression ratios of the members to extract"""
+        total = 0
+        for entry in entries:
+            if entry.size > self.max_entry_size:
+                raise ArchiveBudgetError(
+                    f"{entry.name} is {_mb(entry.size)}, more than the limit of {_mb(self.max_entry_size)} per file"
+                )
+            if (entry.compressed_size and entry.size >= RATIO_MIN_SIZE
+                    and entry.size > self.max_ratio * entry.compressed_size):
+                raise ArchiveBudgetError(
+                    f"{entry.name} is compressed more than {self.max_ratio:g}:1, which looks like a zip bomb"
+                )
+            total += entry.size
+        if total > self.max_total:
+            raise ArchiveBudgetError(
+                f"it unpacks to {_mb(total)}, more than the limit of {_mb(self.max_total)}"
+            )
+        self._check_ratio(total, archive_size)
+
+    def meter(self, archive_size):
+        return ExtractionMeter(self, archive_size)
+
+    def _check_ratio(self, total, archive_size):
+        if total >= RATIO_MIN_SIZE and total > self.max_ratio * archive_size:
+            raise ArchiveBudgetError(
+                f"it unpacks to more than {self.max_ratio:g} times its size, which looks like a zip bomb"
+            )
+
+class ExtractionMeter:
+    """Counts the bytes written during one extraction against an ArchiveBudget"""
+
+    def __init__(self, budget, archive_size):
+        self.budget = budget
+        self.archive_size = archive_size
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def add(self, count, entry_written, name):
+        """Account for count more bytes of member name, entry_written bytes of it so far"""
+        with self._lock:
+            self.total += count
+            total = self.total
+        if entry_written > self.budget.max_entry_size:
+            raise ArchiveBudgetError(
+                f"{name} unpacks to more than the limit of {_mb(self.budget.max_entry_size)} per file"
+            )
+        if total > self.budget.max_total:
+            raise ArchiveBudgetError(
+                f"it unpacks to more than the limit of {_mb(self.budget.max_total)}"
+            )
+        self.budget._check_ratio(total, self.archive_size)
+
+def copy_member(src, dst, name, meter=None):
+    """Copy an open member to dst in chunks, metering the bytes written"""
+    written = 0
+    while True:
+        data = src.read(COPY_CHUNK)
+        if not data:
+            break
+        written += len(data)
+        if meter is not None:
+            meter.add(len(data), written, name)
+        dst.write(data)
+
+class MissingRange(Exception):
+    """Raised when a SparseFile read touches chunks that have not been fetched"""
+
+class SparseFile(io.RawIOBase):
+    """A file of known size on disk of which only some chunks are present.
+
+    Chunks are written at their offsets as they are fetched, so a file whose
+    chunks are all present is an ordinary file at `path`. A read that touches
+    a missing chunk raises MissingRange and records the chunks in `missing`,
+    which survives libraries that catch the exception themselves; the caller
+    fetches them and retries.
+    """
+
+    def __init__(self, path, size, chunk_size=SPARSE_CHUNK):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = -(-size // chunk_size)
+        self.present = set()
+        self.missing = None
+        self._pos = 0
+        self._fp = open(path, 'w+b')
+        self._fp.truncate(size)
+
+    def write_chunk(self, index, data):
+        self._fp.seek(index * self.chunk_size)
+        self._fp.write(data)
+        self.present.add(index)
+
+    def chunks_for(self, start, end):
+        """Indices of the missing chunks overlapping bytes [start, end)"""
+        end = min(end, self.size)
+        if end <= start:
+            return []
+        return [
+            index for index in range(start // self.chunk_size, (end - 1) // self.chunk_size + 1)
+            if index not in self.present
+        ]
+
+    def missing_chunks(self):
+        return [index for index in range(self.chunk_count) if index not in self.present]
+
+    def is_complete(self):
+        return len(self.present) == self.chunk_count
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        length = min(len(b), self.size - self._pos)
+        if length <= 0:
+            return 0
+        missing = self.chunks_for(self._pos, self._pos + length)
+        if missing:
+            self.missing = missing
+            raise MissingRange(f"bytes {self._pos}-{self._pos + length} are not fetched")
+        self._fp.seek(self._pos)
+        read = self._fp.readinto(memoryview(b)[:length])
+        self._pos += read
+        return read
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self._fp.closed:
+            self._fp.close()
+        super().close()
+
+def chunk_runs(chunks):
+    """Group chunk indices into (first, count) runs of consecutive chunks"""
+    runs = []
+    for index in sorted(chunks):
+        if runs and runs[-1][0] + runs[-1][1] == index:
+            runs[-1][1] += 1
+        else:
+            runs.append([index, 1])
+    return [tuple(run) for run in runs]
+
+class ArchiveEntry:
+    """One member of an archive, as listed in its index"""
+
+    def __init__(self, name, size, compressed_size=None, is_dir=False, info=None):
+        self.name = name.replace('\\', '/')
+        self.size = size
+        self.compressed_size = compressed_size
+        self.is_dir = is_dir
+        self.info = info
+
+def safe_member_path(dest_dir, name):
+    """Map a member name to a path inside dest_dir, dropping absolute and '..' parts"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if not parts:
+        raise ArchiveError(f"invalid member name '{name}'")
+    return os.path.join(dest_dir, *parts)
+
+class ArchiveReader:
+    """Common interface of the per-format readers.
+
+    iter_extract() writes one member at a time into dest_dir and yields
+    (entry, path). Nothing is extracted ahead of the consumer, and the caller
+    deletes each path once it is done with it, so disk use is bounded by the
+    members the caller still holds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._read_entries()
+        return self._entries
+
+    def files(self, names=None):
+        """Entries that are regular files, optionally limited to the given names"""
+        return [
+            entry for entry in self.entries()
+            if not entry.is_dir and (names is None or entry.name in names)
+        ]
+
+    def iter_extract(self, dest_dir, names=None, meter=None):
+        for entry in self.files(names):
+            path = safe_member_path(dest_dir, entry.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                with self._open_member(entry) as src, open(path, 'wb') as dst:
+                    copy_member(src, dst, entry.name, meter)
+            except (ArchiveError, zipfile.BadZipFile, rarfile.Error, zlib.error, EOFError, RuntimeError) as e:
+                # RuntimeError is what zipfile raises for encrypted members
+                if os.path.exists(path):
+                    os.remove(path)
+                if isinstance(e, ArchiveError):
+                    raise
+                raise ArchiveError(f"cannot extract {entry.name}: {e}") from e
+            yield entry, path
+
+    def data_ranges(self, entries):
+        """Byte ranges [start, end) of the archive needed to extract entries, or None for all of it"""
+        return None
+
+    def close(self):
+        pass
+
+    def _read_entries(self):
+        raise NotImplementedError
+
+    def _open_member(self, entry):
+        raise NotImplementedError
+
+class ZipReader(ArchiveReader):
+    def __init__(self, path):
+        super().__init__(path)
+        self.archive = zipfile.ZipFile(path)
+
+    def _read_entries(self):
+        return [
+            ArchiveEntry(info.filename, info.file_size, info.compress_size, info.is_dir(), info)
+            for info in self.archive.infolist()
+        ]
+
+    def _open_member(self, entry):
+        return self.archive.open(entry.info)
+
+    def data_ranges(self, entries):
+        # The local header repeats the name and may carry up to 64 KiB of extra
+        # fields; a data descriptor of up to 24 bytes can follow the data
+        return [
+            (entry.info.header_offset,
+             entry.info.header_offset + 30 + 2 * len(entry.info.orig_filename.encode('utf-8'))
+             + 0xFFFF + entry.compressed_size + 24)
+            for entry in entries
+        ]
+
+    def close(self):
+        self.archive.close()
+
+class RarReader(ArchiveReader):
+    """RAR reader; decompression uses the unrar/unar/bsdtar tool rarfile finds"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.archive = rarfile.RarFile(path)
+
+    def _read_entries(self):
+        return [
+            ArchiveEntry(info.filename, info.file_size, info.compress_size, info.is_dir(), info)
+            for info in self.archive.infolist()
+        ]
+
+    def _open_member(self, entry):
+        return self.archive.open(entry.info)
+
+    def close(self):
+        self.archive.close()
+
+class _Stop(Exception):
+    """Aborts a 7z extraction when the consumer stops iterating"""
+
+class _HandoffWriter(Py7zIO):
+    """Writes one 7z member to disk and hands it to the consumer when complete"""
+
+    def __init__(self, path, on_complete, meter=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fp = open(path, 'w+b')
+        self.on_complete = on_complete
+        self.meter = meter
+        self.written = 0
+
+    def write(self, s):
+        if self.meter is not None:
+            self.written += len(s)
+            try:
+                self.meter.add(len(s), self.written, os.path.basename(self.path))
+            except ArchiveBudgetError:
+                # Free the disk now; close() must not hand the file over
+                self.fp.close()
+                os.remove(self.path)
+                raise
+        return self.fp.write(s)
+
+    def read(self, size=None):
+        return self.fp.read(size)
+
+    def seek(self, offset, whence=0):
+        return self.fp.seek(offset, whence)
+
+    def flush(self):
+        self.fp.flush()
+
+    def size(self):
+        return self.fp.tell()
+
+    def close(self):
+        if not self.fp.closed:
+            self.fp.close()
+            self.on_complete(self.path)
+
+class _HandoffFactory(WriterFactory):
+    def __init__(self, on_complete, meter=None):
+        self.on_complete = on_complete
+        self.meter = meter
+
+    def create(self, filename):
+        return _HandoffWriter(filename, self.on_complete, self.meter)
+
+class SevenZipReader(ArchiveReader):
+    """7z reader that decompresses in one pass, pausing after every member.
+
+    Solid 7z archives can only be decompressed front to back, so instead of
+    extracting members one by one (which would restart the solid block each
+    time) py7zr runs in a helper thread and blocks after each finished member
+    until the consumer has dealt with it.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.archive = py7zr.SevenZipFile(path)
+
+    def _read_entries(self):
+        return [
+            ArchiveEntry(info.filename, info.uncompressed, info.compressed, info.is_directory, info)
+            for info in self.archive.list()
+        ]
+
+    def iter_extract(self, dest_dir, names=None, meter=None):
+        dest_dir = os.path.abspath(dest_dir)
+        entries = {entry.name: entry for entry in self.files(names)}
+        if not entries:
+            return
+        handoff = queue.Queue(maxsize=1)
+        resume = threading.Semaphore(0)
+        stopped = threading.Event()
+        done = object()
+
+        def on_complete(path):
+            handoff.put(path)
+            resume.acquire()
+            if stopped.is_set():
+                raise _Stop()
+
+        def extract():
+            try:
+                self.archive.reset()
+                self.archive.extract(
+                    path=dest_dir, targets=list(entries), factory=_HandoffFactory(on_complete, meter)
+                )
+                handoff.put(done)
+            except _Stop:
+                pass
+            except Exception as e:
+                if not stopped.is_set():
+                    handoff.put(e)
+
+        worker = threading.Thread(target=extract, name="7z-extract", daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = handoff.get()
+                if item is done:
+                    break
+                if isinstance(item, ArchiveError):
+                    raise item
+                if isinstance(item, Exception):
+                    raise ArchiveError(str(item)) from item
+                name = os.path.relpath(item, dest_dir).replace(os.sep, '/')
+                entry = entries.get(name) or ArchiveEntry(name, os.path.getsize(item))
+                yield entry, item
+                resume.release()
+        finally:
+            stopped.set()
+            # py7zr may decompress several folders in parallel threads; keep
+            # unblocking writers until every one of them has given up
+            while worker.is_alive():
+                resume.release()
+                try:
+                    handoff.get_nowait()
+                except queue.Empty:
+                    pass
+                worker.join(0.05)
+
+    def close(self):
+        self.archive.close()
+
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+RAR_MAGIC = b"Rar!\x1a\x07"
+SEVEN_ZIP_MAGIC = b"7z\xbc\xaf\x27\x1c"
+
+def open_archive(source):
+    """Return the reader matching the archive's signature; source is a path or a seekable file"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            head = f.read(8)
+    else:
+        source.seek(0)
+        head = source.read(8)
+        source.seek(0)
+    try:
+        if head.startswith(SEVEN_ZIP_MAGIC):
+            return SevenZipReader(source)
+        if head.startswith(RAR_MAGIC):
+            return RarReader(source)
+        if head.startswith(ZIP_MAGIC) or zipfile.is_zipfile(source):
+            return ZipReader(source)
+    except (zipfile.BadZipFile, rarfile.Error, Bad7zFile) as e:
+        raise ArchiveError(f"damaged archive: {e}") from e
+    raise ArchiveError("unsupported archive format (ZIP, RAR and 7z are supported)")
+
+def list_archive(source):
+    """Read just the index of an archive and return its file entries"""
+    reader = open_archive(source)
+    try:
+        return reader.files()
+    finally:
+        reader.close()
@@ -4,45 +4,227 @@ Service layer for image processing operations
 """
 from PIL import Image
 from io import BytesIO
+import numpy as np
 import os
+from config.settings import RESIZE_MODE, RESIZE_REDUCING_GAP
+from utils.file_utils import is_buffer
+
+# Longest side of the downscaled proxy used to model the size/quality curve
+PROXY_MAX_SIDE = 512
+# Maximum number of full-resolution encodes per downscale round; the
+# search usually stops after two or three, once a result is close enough
+MAX_FULL_ENCODES = 6
+# Accept a result once it reaches this fraction of the target size
+ACCEPT_RATIO = 0.9
+# Quality the downscale fallback aims for when quality 1 is still too large
+FALLBACK_QUALITY = 75
+MAX_DOWNSCALE_ROUNDS = 4
+# SSIM is computed on luminance downscaled to this longest side
+SSIM_MAX_SIDE = 512
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+# Quality steps to take when the full-size check misses the SSIM target
+SSIM_CONFIRM_STEP = 5
+
+def luminance(image, max_side=SSIM_MAX_SIDE):
+    """Return the downscaled luminance of image as a float array"""
+    gray = image.convert('L')
+    if max(gray.size) > max_side:
+        gray.thumbnail((max_side, max_side), Image.BILINEAR)
+    return np.asarray(gray, dtype=np.float64)
+
+def _box_mean(values, size):
+    """Mean over every size x size window, via an integral image"""
+    integral = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (
+        integral[size:, size:] - integral[:-size, size:]
+        - integral[size:, :-size] + integral[:-size, :-size]
+    ) / float(size * size)
+
+def ssim(reference, candidate, window=SSIM_WINDOW):
+    """Mean structural similarity of two equally sized luminance arrays"""
+    window = max(1, min(window, *reference.shape))
+    mu_r = _box_mean(reference, window)
+    mu_c = _box_mean(candidate, window)
+    var_r = _box_mean(reference * reference, window) - mu_r * mu_r
+    var_c = _box_mean(candidate * candidate, window) - mu_c * mu_c
+    covar = _box_mean(reference * candidate, window) - mu_r * mu_c
+    numerator = (2 * mu_r * mu_c + SSIM_C1) * (2 * covar + SSIM_C2)
+    denominator = (mu_r * mu_r + mu_c * mu_c + SSIM_C1) * (var_r + var_c + SSIM_C2)
+    return float((numerator / denominator).mean())
 
 class ImageService:
     def __init__(self):
         self.user_settings = {}
 
-    def process_image_size(self, image, target_file_size, output_path):
-        """Process image to match target file size"""
-        min_quality = 1
-        max_quality = 95
-        best_output = None
-        best_quality = None
+    def encode_jpeg(self, image, quality):
+        """Encode image as JPEG and return the buffer"""
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+        return output
+
+    def write_output(self, output, data):
+        """Write data to a path or an in-memory buffer"""
+        if is_buffer(output):
+            output.seek(0)
+            output.truncate()
+            output.write(data)
+        else:
+            with open(output, 'wb') as f:
+                f.write(data)
+
+    def make_proxy(self, image):
+        """Return a small copy of image used to model encoder behaviour"""
+        proxy = image.copy()
+        proxy.thumbnail((PROXY_MAX_SIDE, PROXY_MAX_SIDE), Image.BILINEAR)
+        return proxy
+
+    def search_quality(self, accept, min_quality=1, max_quality=95):
+        """Return the highest quality in range for which accept(quality) holds.
 
+        accept must be monotone (true for low qualities, false above some
+        threshold). Returns None if it fails even at min_quality.
+        """
+        best = None
         while min_quality <= max_quality:
             quality = (min_quality + max_quality) // 2
-            output = BytesIO()
-            image.save(output, format='JPEG', quality=quality)
-            size_kb = output.tell() / 1024
+            if accept(quality):
+                best = quality
+                min_quality = quality + 1
+            else:
+                max_quality = quality - 1
+        return best
+
+    def process_image_size(self, image, target_file_size, output_path):
+        """Process image to match target file size.
+
+        output_path may be a file path or a writable buffer.
+
+        The size/quality curve is measured on a small proxy and scaled to the
+        full image; full encodes then narrow a fit/overflow bracket until the
+        result is within ACCEPT_RATIO of the target. If quality 1 is still
+        too large the image is downscaled.
+        Returns (output_path, quality, (width, height)).
+        """
+        target_bytes = target_file_size * 1024
+        current = image
+
+        for _ in range(MAX_DOWNSCALE_ROUNDS):
+            proxy = self.make_proxy(current)
+            proxy_sizes = {}
 
-            if abs(size_kb - target_file_size) < 1 or max_quality - min_quality <= 1:
-                best_output = output
-                best_quality = quality
+            def proxy_size(quality):
+                if quality not in proxy_sizes:
+                    proxy_sizes[quality] = self.encode_jpeg(proxy, quality).tell()
+                return proxy_sizes[quality]
+
+            # Start from the pixel ratio, then calibrate against real encodes.
+            # fit/over bracket the answer: the highest quality known to fit
+            # and the lowest known to overflow, with their encoded sizes
+            scale = (current.width * current.height) / float(proxy.width * proxy.height)
+            best_output = None
+            fit = None
+            over = None
+            tried = set()
+
+            for _ in range(MAX_FULL_ENCODES):
+                low = fit[0] + 1 if fit else 1
+                high = over[0] - 1 if over else 95
+                if low > high:
+                    break
+                if fit and over:
+                    # Interpolate between the two real encodes
+                    position = (target_bytes - fit[1]) / float(over[1] - fit[1])
+                    quality = fit[0] + int(position * (over[0] - fit[0]))
+                else:
+                    quality = self.search_quality(
+                        lambda q: proxy_size(q) * scale <= target_bytes, low, high
+                    ) or low
+                quality = min(max(quality, low), high)
+                tried.add(quality)
+
+                output = self.encode_jpeg(current, quality)
+                size = output.tell()
+                if size <= target_bytes:
+                    fit = (quality, size)
+                    best_output = output
+                    if size >= target_bytes * ACCEPT_RATIO:
+                        break
+                else:
+                    over = (quality, size)
+                scale = size / float(proxy_size(quality))
+            best_quality = fit[0] if fit else None
+
+            if best_output is None and 1 not in tried:
+                output = self.encode_jpeg(current, 1)
+                if output.tell() <= target_bytes:
+                    best_output, best_quality = output, 1
+
+            if best_output is not None:
+                self.write_output(output_path, best_output.getvalue())
+                return output_path, best_quality, current.size
+
+            # Even quality 1 is too big: shrink so the target fits at a sane quality
+            predicted = proxy_size(FALLBACK_QUALITY) * scale
+            factor = min(0.9, (target_bytes / predicted) ** 0.5 * 0.95)
+            width = max(1, int(current.width * factor))
+            height = max(1, int(current.height * factor))
+            if (width, height) == current.size:
                 break
-            elif size_kb > target_file_size:
-                max_quality = quality - 1
-            else:
-                min_quality = quality + 1
+            current = current.resize((width, height), Image.LANCZOS)
+
+        return None, None, None
+
+    def process_image_quality(self, image, min_ssim, output_path):
+        """Encode the smallest JPEG whose SSIM against the original is >= min_ssim.
+
+        The quality search runs on a downscaled proxy; the chosen quality is
+        then confirmed once on the full-size encode, stepping up if needed.
+        Returns (output_path, quality, achieved_ssim).
+        """
+        proxy = image.copy()
+        proxy.thumbnail((SSIM_MAX_SIDE, SSIM_MAX_SIDE), Image.BILINEAR)
+        proxy_reference = luminance(proxy)
 
-        if best_output is None:
-            return None, None
+        def proxy_fails(quality):
+            with Image.open(self.encode_jpeg(proxy, quality)) as decoded:
+                return ssim(proxy_reference, luminance(decoded)) < min_ssim
+
+        # Highest failing quality on the proxy; the next one up is the answer
+        quality = min(95, (self.search_quality(proxy_fails) or 0) + 1)
+
+        reference = luminance(image)
+        while True:
+            output = self.encode_jpeg(image, quality)
+            with Image.open(output) as decoded:
+                candidate = luminance(decoded)
+            achieved = ssim(reference, candidate)
+            if achieved >= min_ssim or quality >= 95:
+                break
+            quality = min(95, quality + SSIM_CONFIRM_STEP)
 
-        with open(output_path, 'wb') as f:
-            f.write(best_output.getvalue())
+        self.write_output(output_path, output.getvalue())
+        return output_path, quality, achieved
 
-        return output_path, best_quality
+    def process_image_dimensions(self, image, width, height, output_path, mode=None):
+        """Process image to match target dimensions into a path or buffer.
 
-    def process_image_dimensions(self, image, width, height, output_path):
-        """Process image to match target dimensions"""
-        resized_image = image.copy()
-        resized_image.thumbnail((width, height), Image.LANCZOS)
+        In "fast" mode the still-undecoded image is resized in place: JPEGs
+        are decoded at a reduced DCT scale (draft) and large reductions are
+        pre-shrunk with reduce() before the final LANCZOS pass, keeping at
+        least RESIZE_REDUCING_GAP times the target size for the resample.
+        """
+        if (mode or RESIZE_MODE) == "quality":
+            resized_image = image.copy()
+            resized_image.thumbnail((width, height), Image.LANCZOS, reducing_gap=None)
+        else:
+            resized_image = image
+            if image.format == 'JPEG':
+                # No-op once the image has been loaded
+                image.draft(None, (int(width * RESIZE_REDUCING_GAP),
+                                   int(height * RESIZE_REDUCING_GAP)))
+            resized_image.thumbnail((width, height), Image.LANCZOS,
+                                    reducing_gap=RESIZE_REDUCING_GAP)
         resized_image.save(output_path, 'JPEG', quality=95)
         return output_path
@@ -0,0 +1,314 @@
+# services/pdf_service.py
+"""
+Pluggable PDF engines (PyPDF2 and PyMuPDF) behind one interface
+"""
+import threading
+from io import BytesIO
+import pymupdf
+from PIL import Image, ImageDraw, ImageFont
+from PyPDF2 import PdfReader, PdfWriter, PdfMerger
+from config.settings import PDF_ENGINES
+from utils.file_utils import is_buffer
+
+class RenderOptions:
+    """Output format and resolution for rendered pages.
+
+    dpi defaults to 144 (2x zoom). With max_side alone, pages are scaled so
+    their longer edge is max_side pixels; with both, max_side caps the dpi.
+    """
+    FORMATS = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'webp': 'webp'}
+    DEFAULT_DPI = 144
+
+    def __init__(self, image_format='png', quality=85, dpi=None, max_side=None, gray=False):
+        self.image_format = image_format
+        self.quality = quality
+        self.dpi = dpi
+        self.max_side = max_side
+        self.gray = gray
+
+    @property
+    def extension(self):
+        return 'jpg' if self.image_format == 'jpeg' else self.image_format
+
+    def params(self):
+        """Options as a dict, for cache keys"""
+        return {
+            'format': self.image_format, 'quality': self.quality, 'dpi': self.dpi,
+            'max': self.max_side, 'gray': self.gray
+        }
+
+    def zoom(self, width, height):
+        """Scale factor for a page of width x height points"""
+        if self.max_side and self.dpi is None:
+            return self.max_side / max(width, height)
+        zoom = (self.dpi or self.DEFAULT_DPI) / 72
+        if self.max_side:
+            zoom = min(zoom, self.max_side / max(width, height))
+        return zoom
+
+    @classmethod
+    def parse(cls, args):
+        """Build options from words like 'jpeg', 'q=80', 'dpi=150', 'max=2000', 'gray'"""
+        options = cls()
+        for arg in args:
+            word = arg.lower()
+            key, _, value = word.partition('=')
+            if word in cls.FORMATS:
+                options.image_format = cls.FORMATS[word]
+            elif word in ('gray', 'grey'):
+                options.gray = True
+            elif key in ('q', 'quality', 'dpi', 'max') and value.isdigit():
+                number = int(value)
+                if key in ('q', 'quality'):
+                    if not 1 <= number <= 100:
+                        raise ValueError("quality must be between 1 and 100")
+                    options.quality = number
+                elif key == 'dpi':
+                    if not 36 <= number <= 600:
+                        raise ValueError("dpi must be between 36 and 600")
+                    options.dpi = number
+                else:
+                    if not 100 <= number <= 10000:
+                        raise ValueError("max must be between 100 and 10000 pixels")
+                    options.max_side = number
+            else:
+                raise ValueError(f"unknown option '{arg}'")
+        return options
+
+class PdfEngine:
+    """Operations the handlers need from a PDF library.
+
+    Sources and outputs may be file paths or in-memory buffers. Page
+    numbers are 0-based.
+    """
+    name = None
+
+    def open(self, source):
+        raise NotImplementedError
+
+    def close(self, doc):
+        pass
+
+    def page_count(self, doc):
+        raise NotImplementedError
+
+    def is_encrypted(self, doc):
+        """Return True if the document cannot be read without a password"""
+        raise NotImplementedError
+
+    def extract_pages(self, doc, pages, output):
+        """Write the given pages of doc, in order, into a new PDF at output"""
+        raise NotImplementedError
+
+    def merge(self, sources, output):
+        """Concatenate the source PDFs into output"""
+        raise NotImplementedError
+
+    def render(self, doc, page, options=None):
+        """Render one page and return the encoded image bytes"""
+        raise NotImplementedError(f"The {self.name} engine cannot render pages")
+
+    def thumbnail(self, doc, page, max_side):
+        """Render one page as an RGB Pillow image whose longer edge is max_side"""
+        raise NotImplementedError(f"The {self.name} engine cannot render pages")
+
+class PyPDF2Engine(PdfEngine):
+    name = "pypdf2"
+
+    def open(self, source):
+        return PdfReader(source)
+
+    def page_count(self, doc):
+        return len(doc.pages)
+
+    def is_encrypted(self, doc):
+        return doc.is_encrypted
+
+    def extract_pages(self, doc, pages, output):
+        writer = PdfWriter()
+        for page in pages:
+            writer.add_page(doc.pages[page])
+        writer.write(output)
+
+    def merge(self, sources, output):
+        merger = PdfMerger()
+        try:
+            for source in sources:
+                merger.append(source)
+            merger.write(output)
+        finally:
+            merger.close()
+
+class PyMuPDFEngine(PdfEngine):
+    """MuPDF-backed engine.
+
+    A document must not be used from several threads at once, so each one
+    opened here carries its own lock; separate documents (other chats,
+    merges) run on separate threads without waiting for each other. Use
+    processes to render one document in parallel.
+    """
+    name = "pymupdf"
+
+    def open(self, source):
+        if is_buffer(source):
+            doc = pymupdf.open(stream=source.getvalue(), filetype="pdf")
+        else:
+            doc = pymupdf.open(source)
+        doc._engine_lock = threading.RLock()
+        return doc
+
+    @staticmethod
+    def lock(doc):
+        return doc._engine_lock
+
+    def close(self, doc):
+        with self.lock(doc):
+            doc.close()
+
+    def page_count(self, doc):
+        return doc.page_count
+
+    def is_encrypted(self, doc):
+        return doc.needs_pass
+
+    def extract_pages(self, doc, pages, output):
+        with self.lock(doc):
+            out = pymupdf.open()
+            try:
+                # Insert consecutive runs in one call
+                start = prev = None
+                for page in list(pages) + [None]:
+                    if start is not None and (page is None or page != prev + 1):
+                        out.insert_pdf(doc, from_page=start, to_page=prev)
+                        start = None
+                    if page is not None and start is None:
+                        start = page
+                    prev = page
+                self._save(out, output)
+            finally:
+                out.close()
+
+    # Drop unused objects, merge identical ones (fonts, images, ICC profiles
+    # shared across inputs) and compress every stream on output
+    MERGE_SAVE_OPTIONS = {
+        'garbage': 4, 'deflate': True, 'deflate_images': True, 'deflate_fonts': True, 'use_objstms': 1
+    }
+
+    def merge(self, sources, output):
+        """Append sources one at a time, so only one input is open at once.
+
+        Every document involved is private to this call, so no lock is taken.
+        """
+        out = pymupdf.open()
+        try:
+            for source in sources:
+                doc = self.open(source)
+                try:
+                    out.insert_pdf(doc)
+                finally:
+                    doc.close()
+            self._save(out, output, **self.MERGE_SAVE_OPTIONS)
+        finally:
+            out.close()
+
+    def render(self, doc, page, options=None):
+        options = options or RenderOptions()
+        with self.lock(doc):
+            page = doc[page]
+            zoom = options.zoom(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(
+                matrix=pymupdf.Matrix(zoom, zoom),
+                colorspace=pymupdf.csGRAY if options.gray else pymupdf.csRGB
+            )
+            if options.image_format != 'webp':
+                return pix.tobytes(options.image_format, jpg_quality=options.quality)
+            # MuPDF has no WebP encoder; hand the raw samples to Pillow
+            image = Image.frombytes('L' if pix.n == 1 else 'RGB', (pix.width, pix.height), pix.samples)
+        output = BytesIO()
+        image.save(output, 'WEBP', quality=options.quality)
+        return output.getvalue()
+
+    def thumbnail(self, doc, page, max_side):
+        with self.lock(doc):
+            page = doc[page]
+            zoom = max_side / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=pymupdf.csRGB)
+            return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+    def _save(self, doc, output, **options):
+        if is_buffer(output):
+            output.write(doc.tobytes(**options))
+        else:
+            doc.save(output, **options)
+
+# Contact sheet layout for /pdf2image preview
+THUMB_SIDE = 240
+SHEET_COLUMNS = 5
+SHEET_ROWS = 4
+SHEET_PADDING = 12
+LABEL_HEIGHT = 24
+PREVIEW_MAX_PAGES = 100
+
+def sample_pages(pages, limit=PREVIEW_MAX_PAGES):
+    """Pick at most limit pages spread evenly over pages, keeping the first and last"""
+    if len(pages) <= limit:
+        return list(pages)
+    step = (len(pages) - 1) / (limit - 1)
+    return [pages[round(k * step)] for k in range(limit)]
+
+def _label_font():
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", 16)
+    except OSError:
+        return ImageFont.load_default()
+
+def make_contact_sheets(engine, doc, pages, max_side=THUMB_SIDE):
+    """Tile low-resolution thumbnails of pages into labelled grid images.
+
+    Returns a list of (jpeg_bytes, sheet_pages), one per sheet of up to
+    SHEET_COLUMNS x SHEET_ROWS pages.
+    """
+    per_sheet = SHEET_COLUMNS * SHEET_ROWS
+    cell_width = max_side + SHEET_PADDING
+    cell_height = max_side + LABEL_HEIGHT + SHEET_PADDING
+    font = _label_font()
+    sheets = []
+    for start in range(0, len(pages), per_sheet):
+        sheet_pages = pages[start:start + per_sheet]
+        rows = -(-len(sheet_pages) // SHEET_COLUMNS)
+        columns = min(len(sheet_pages), SHEET_COLUMNS)
+        sheet = Image.new(
+            'RGB', (columns * cell_width + SHEET_PADDING, rows * cell_height + SHEET_PADDING), (235, 235, 235)
+        )
+        draw = ImageDraw.Draw(sheet)
+        for n, page in enumerate(sheet_pages):
+            thumb = engine.thumbnail(doc, page, max_side)
+            x = SHEET_PADDING + (n % SHEET_COLUMNS) * cell_width
+            y = SHEET_PADDING + (n // SHEET_COLUMNS) * cell_height
+            sheet.paste(thumb, (x + (max_side - thumb.width) // 2, y + (max_side - thumb.height) // 2))
+            label = str(page + 1)
+            label_width = draw.textlength(label, font=font)
+            draw.text((x + (max_side - label_width) / 2, y + max_side + 4), label, fill=(40, 40, 40), font=font)
+        output = BytesIO()
+        sheet.save(output, 'JPEG', quality=85)
+        sheets.append((output.getvalue(), sheet_pages))
+    return sheets
+
+ENGINES = {engine.name: engine for engine in (PyPDF2Engine, PyMuPDFEngine)}
+
+def get_pdf_engine(operation):
+    """Return the engine configured for an operation ('split', 'merge', 'render')"""
+    name = PDF_ENGINES.get(operation, "pymupdf")
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown PDF engine '{name}' for {operation}")
+
+def render_page_range(source, pages, options=None):
+    """Process-pool job: open source in this process and render the given pages"""
+    engine = get_pdf_engine("render")
+    doc = engine.open(source)
+    try:
+        return [engine.render(doc, page, options) for page in pages]
+    finally:
+        engine.close(doc)
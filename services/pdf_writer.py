@@ -0,0 +1,184 @@
+# services/pdf_writer.py
+"""
+Streaming image-to-PDF writer that embeds JPEG data without re-encoding
+"""
+import os
+import shutil
+import zlib
+from io import BytesIO
+from PIL import Image, ImageOps
+
+ORIENTATION_TAG = 0x0112
+COLOR_SPACES = {'L': '/DeviceGray', 'RGB': '/DeviceRGB', 'CMYK': '/DeviceCMYK'}
+
+class PreparedImage:
+    """Page-ready image data: a JPEG file embedded as-is, or Flate-compressed pixels"""
+
+    def __init__(self, width, height, color_space, filter_name, data=None, data_path=None, decode=None):
+        self.width = width
+        self.height = height
+        self.color_space = color_space
+        self.filter_name = filter_name
+        self.data = data
+        self.data_path = data_path
+        self.decode = decode
+
+    @property
+    def length(self):
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.data_path)
+
+    def write_data(self, fp):
+        if self.data is not None:
+            fp.write(self.data)
+        else:
+            with open(self.data_path, 'rb') as src:
+                shutil.copyfileobj(src, fp, 1024 * 1024)
+
+def prepare_image(path, spill_path=None):
+    """Inspect an image file and return how to embed it in a PDF page.
+
+    Baseline and progressive JPEGs in L/RGB/CMYK are passed through as
+    DCTDecode streams. JPEGs with an EXIF rotation are turned upright and
+    re-encoded once. Anything else (PNG, GIF, ...) is decoded once,
+    flattened onto white if it has transparency and stored losslessly.
+    When spill_path is given, re-encoded data is written there instead of
+    being kept in memory.
+    """
+    with Image.open(path) as image:
+        orientation = image.getexif().get(ORIENTATION_TAG, 1)
+        if image.format == 'JPEG' and image.mode in COLOR_SPACES and orientation == 1:
+            decode = None
+            if image.mode == 'CMYK' and 'adobe' in image.info:
+                # Adobe CMYK JPEGs store inverted components
+                decode = '[1 0 1 0 1 0 1 0]'
+            return PreparedImage(
+                image.width, image.height, COLOR_SPACES[image.mode], '/DCTDecode',
+                data_path=path, decode=decode
+            )
+
+        if image.format == 'JPEG' and image.mode in ('L', 'RGB'):
+            upright = ImageOps.exif_transpose(image)
+            output = BytesIO()
+            upright.save(output, 'JPEG', quality=95)
+            prepared = PreparedImage(
+                upright.width, upright.height, COLOR_SPACES[upright.mode], '/DCTDecode',
+                data=output.getvalue()
+            )
+        else:
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+                rgba = image.convert('RGBA')
+                converted = Image.new('RGB', rgba.size, (255, 255, 255))
+                converted.paste(rgba, mask=rgba.split()[-1])
+            elif image.mode in ('1', 'L'):
+                converted = image.convert('L')
+            else:
+                converted = image.convert('RGB')
+            prepared = PreparedImage(
+                converted.width, converted.height, COLOR_SPACES[converted.mode], '/FlateDecode',
+                data=zlib.compress(converted.tobytes(), 6)
+            )
+
+    if spill_path is not None:
+        with open(spill_path, 'wb') as f:
+            f.write(prepared.data)
+        prepared.data, prepared.data_path = None, spill_path
+    return prepared
+
+class StreamingPdfWriter:
+    """Write one image per page straight to the output file.
+
+    Pages are written as soon as they are added, so only the current page's
+    data is ever held in memory. Each page is sized in points to the image's
+    pixel dimensions, like Pillow's PDF output at 72 dpi.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, output):
+        if isinstance(output, (str, bytes, os.PathLike)):
+            self.fp = open(output, 'wb')
+            self._owns_fp = True
+        else:
+            self.fp = output
+            self._owns_fp = False
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3
+        self.fp.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._owns_fp:
+            self.fp.close()
+
+    @property
+    def page_count(self):
+        return len(self.page_ids)
+
+    def add_image(self, path):
+        """Prepare an image file and append it as a new page"""
+        self.add_prepared(prepare_image(path))
+
+    def add_prepared(self, prepared):
+        """Append a PreparedImage as a new page"""
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+
+        decode = f" /Decode {prepared.decode}" if prepared.decode else ""
+        self._begin(image_id)
+        self._write(
+            f"<< /Type /XObject /Subtype /Image /Width {prepared.width} /Height {prepared.height} "
+            f"/ColorSpace {prepared.color_space} /BitsPerComponent 8 "
+            f"/Filter {prepared.filter_name}{decode} /Length {prepared.length} >>\nstream\n"
+        )
+        prepared.write_data(self.fp)
+        self._write("\nendstream\nendobj\n")
+
+        content = f"q {prepared.width} 0 0 {prepared.height} 0 0 cm /Im0 Do Q".encode()
+        self._begin(content_id)
+        self._write(f"<< /Length {len(content)} >>\nstream\n")
+        self.fp.write(content)
+        self._write("\nendstream\nendobj\n")
+
+        self._begin(page_id)
+        self._write(
+            f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+            f"/MediaBox [0 0 {prepared.width} {prepared.height}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+            f"/Contents {content_id} 0 R >>\nendobj\n"
+        )
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._begin(self.PAGES_ID)
+        self._write(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>\nendobj\n")
+        self._begin(self.CATALOG_ID)
+        self._write(f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>\nendobj\n")
+
+        xref_offset = self.fp.tell()
+        self._write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n")
+        for obj_id in range(1, self.next_id):
+            self._write(f"{self.offsets[obj_id]:010d} 00000 n \n")
+        self._write(
+            f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n"
+        )
+        if self._owns_fp:
+            self.fp.close()
+
+    def _begin(self, obj_id):
+        self.offsets[obj_id] = self.fp.tell()
+        self._write(f"{obj_id} 0 obj\n")
+
+    def _write(self, text):
+        self.fp.write(text.encode('latin-1'))
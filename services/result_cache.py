@@ -0,0 +1,170 @@
+# services/result_cache.py
+"""
+Persistent cache of already uploaded results, keyed by input file and operation
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pyrogram.errors import FloodWait
+from pyrogram.types import InputMediaDocument, InputMediaPhoto
+from config.settings import RESULT_CACHE_PATH, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """Map (file_unique_id, operation, params) to the file_ids we uploaded.
+
+    Each cached result is a list of items like
+    {'type': 'document', 'file_id': ..., 'caption': ...}, in sending order.
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 max_age=RESULT_CACHE_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, items TEXT NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(file_unique_id, operation, **params):
+        return json.dumps([file_unique_id, operation, params], sort_keys=True)
+
+    def get(self, key):
+        """Return the cached items for key, or None; counts hits and misses"""
+        operation = json.loads(key)[1]
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT items, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._count("misses", operation)
+                return None
+            self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+            self._count("hits", operation)
+        return json.loads(row[0])
+
+    def put(self, key, items):
+        """Store the items for key and evict old or excess entries"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, items, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(items), now, now)
+            )
+            self._db.execute("DELETE FROM results WHERE created < ?", (now - self.max_age,))
+            self._db.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def invalidate(self, key):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def stats(self):
+        """Return hit/miss counters (overall and per operation) and entry count"""
+        with self._lock:
+            stats = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+            stats['entries'] = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return stats
+
+    def _count(self, counter, operation):
+        for name in (counter, f"{counter}:{operation}"):
+            self._db.execute(
+                "INSERT INTO stats (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (name,)
+            )
+
+def cached_item(message, caption=None):
+    """Describe an uploaded message as a cache item"""
+    if message.photo:
+        return {'type': 'photo', 'file_id': message.photo.file_id, 'caption': caption}
+    return {'type': 'document', 'file_id': message.document.file_id, 'caption': caption}
+
+ALBUM_SIZE = 10  # Telegram's media group limit
+FLOOD_RETRIES = 3
+
+def cached_batches(items):
+    """Split items into runs of one type of at most ALBUM_SIZE; photos and documents can't share an album"""
+    batches = []
+    for item in items:
+        if batches and batches[-1][0]['type'] == item['type'] and len(batches[-1]) < ALBUM_SIZE:
+            batches[-1].append(item)
+        else:
+            batches.append([item])
+    return batches
+
+async def send_cached(client, chat_id, items, on_sent=None):
+    """Re-send cached items by file_id as albums, without downloading or uploading.
+
+    on_sent(count) is called after each batch goes out, so callers can tell
+    a partial failure from a failure before anything was sent.
+    """
+    for batch in cached_batches(items):
+        for attempt in range(FLOOD_RETRIES + 1):
+            try:
+                if len(batch) == 1:
+                    item = batch[0]
+                    send = client.send_photo if item['type'] == 'photo' else client.send_document
+                    await send(chat_id, item['file_id'], caption=item.get('caption'))
+                else:
+                    media_type = InputMediaPhoto if batch[0]['type'] == 'photo' else InputMediaDocument
+                    await client.send_media_group(
+                        chat_id, [media_type(item['file_id'], caption=item.get('caption')) for item in batch]
+                    )
+                break
+            except FloodWait as e:
+                if attempt == FLOOD_RETRIES:
+                    raise
+                await asyncio.sleep(e.value if isinstance(e.value, (int, float)) else 1)
+        if on_sent is not None:
+            on_sent(len(batch))
+
+async def reply_from_cache(client, chat_id, key):
+    """Answer a request from the cache; returns False on a miss or if nothing could be re-sent"""
+    items = result_cache.get(key)
+    if items is None:
+        return False
+    sent = 0
+
+    def count(batch_size):
+        nonlocal sent
+        sent += batch_size
+
+    try:
+        await send_cached(client, chat_id, items, on_sent=count)
+        return True
+    except Exception as e:
+        logger.error(f"Cached result could not be re-sent, dropping it: {e}")
+        result_cache.invalidate(key)
+        if not sent:
+            return False
+        # Redoing the job now would repeat what was already delivered
+        await client.send_message(
+            chat_id,
+            f"⚠️ Only {sent} of {len(items)} results could be re-sent. "
+            "Send the command again to process the file from scratch."
+        )
+        return True
+
+result_cache = ResultCache()
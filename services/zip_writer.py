@@ -0,0 +1,89 @@
+# services/zip_writer.py
+"""
+Incremental ZIP output split into self-contained volumes
+"""
+import os
+import zipfile
+from config.settings import ZIP_VOLUME_SIZE
+from services.result_cache import cached_item
+
+# Members that are already compressed are stored as-is
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.pdf', '.zip', '.gz', '.7z', '.rar'}
+
+# Local header, data descriptor and central directory record, excluding the name
+ENTRY_OVERHEAD = 30 + 16 + 46
+END_RECORD_SIZE = 22
+
+class ZipVolumeWriter:
+    """Write members one at a time into ZIP volumes of at most volume_size bytes.
+
+    Each volume is a complete archive that opens on its own, so volumes can
+    be uploaded (and deleted) as soon as they are closed. A single member
+    larger than volume_size still gets a volume to itself.
+    """
+
+    def __init__(self, directory, base_name, volume_size=ZIP_VOLUME_SIZE):
+        self.directory = directory
+        self.base_name = base_name
+        self.volume_size = volume_size
+        self.volume_count = 0
+        self._zip = None
+        self._path = None
+        self._members = 0
+        self._central_size = 0
+
+    def add(self, name, data):
+        """Add a member; returns the path of a volume closed to make room, or None"""
+        closed = None
+        name_size = len(name.encode('utf-8'))
+        needed = len(data) + ENTRY_OVERHEAD + 2 * name_size
+        if self._zip is not None and self._members and self._projected_size() + needed > self.volume_size:
+            closed = self._close_volume()
+        if self._zip is None:
+            self._open_volume()
+
+        extension = os.path.splitext(name)[1].lower()
+        compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        self._zip.writestr(name, data, compress_type=compress_type)
+        self._members += 1
+        self._central_size += 46 + name_size
+        return closed
+
+    def close(self):
+        """Close the current volume and return its path, or None if it is empty"""
+        if self._zip is None:
+            return None
+        return self._close_volume()
+
+    def discard(self):
+        """Close and delete the current volume, e.g. after an error"""
+        path = self.close()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def volume_name(self, number):
+        return f"{self.base_name}.zip" if number == 1 else f"{self.base_name}_{number}.zip"
+
+    def _projected_size(self):
+        return self._zip.fp.tell() + self._central_size + END_RECORD_SIZE
+
+    def _open_volume(self):
+        self.volume_count += 1
+        self._path = os.path.join(self.directory, self.volume_name(self.volume_count))
+        self._zip = zipfile.ZipFile(self._path, 'w', allowZip64=True)
+        self._members = 0
+        self._central_size = 0
+
+    def _close_volume(self):
+        self._zip.close()
+        path = self._path
+        self._zip = self._path = None
+        return path
+
+async def upload_volume(client, chat_id, path, caption):
+    """Send a finished volume as a document, delete it and return its cache item"""
+    try:
+        sent = await client.send_document(chat_id, path, caption=caption)
+    finally:
+        os.remove(path)
+    return cached_item(sent, caption)
@@ -0,0 +1,120 @@
+"""
+Shared executors for CPU-bound work, so heavy jobs don't block the event loop
+"""
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config.settings import COMPUTE_WORKERS, PROCESS_WORKERS, PDF_RENDER_WORKERS
+
+_thread_executor = None
+_process_executor = None
+_render_executor = None
+
+def get_compute_executor():
+    """Return the shared thread pool used for Pillow/PyMuPDF/PyPDF2 work"""
+    global _thread_executor
+    if _thread_executor is None:
+        _thread_executor = ThreadPoolExecutor(
+            max_workers=COMPUTE_WORKERS, thread_name_prefix="compute"
+        )
+    return _thread_executor
+
+def get_process_executor():
+    """Return the shared process pool used for long pure-Python jobs"""
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_executor
+
+def get_render_executor():
+    """Return the process pool of PDF_RENDER_WORKERS processes used for /pdf2image"""
+    global _render_executor
+    if _render_executor is None:
+        _render_executor = ProcessPoolExecutor(
+            max_workers=PDF_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _render_executor
+
+async def run_in_executor(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on the compute thread pool and await the result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_compute_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+async def run_in_process(func, *args, **kwargs):
+    """Run a picklable top-level func(*args, **kwargs) on the process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_process_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+async def run_in_render_process(func, *args, **kwargs):
+    """Like run_in_process, but on the dedicated render pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_render_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+async def iterate_in_executor(iterator, lookahead=2):
+    """Async-iterate a blocking iterator on the compute pool.
+
+    Items are produced in a background task that stays at most `lookahead`
+    items ahead of the consumer, so producing the next item overlaps with
+    whatever the consumer awaits (e.g. an upload) while memory stays bounded.
+    """
+    queue = asyncio.Queue(maxsize=max(1, lookahead))
+    done = object()
+
+    async def produce():
+        try:
+            while True:
+                item = await run_in_executor(next, iterator, done)
+                await queue.put(item)
+                if item is done:
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        producer.cancel()
+
+async def aenumerate(aiterable, start=0):
+    """enumerate() for async iterables"""
+    index = start
+    async for item in aiterable:
+        yield index, item
+        index += 1
+
+def shutdown_executors():
+    """Shut down all pools, waiting for running jobs to finish"""
+    global _thread_executor, _process_executor, _render_executor
+    if _thread_executor is not None:
+        _thread_executor.shutdown(wait=True)
+        _thread_executor = None
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=True)
+        _process_executor = None
+    if _render_executor is not None:
+        _render_executor.shutdown(wait=True)
+        _render_executor = None
@@ -2,6 +2,8 @@
 Utility functions for file operations
 """
 import os
+from io import BytesIO
+from config.settings import IN_MEMORY_THRESHOLD
 
 def get_user_folder(chat_id):
     """Create and return user-specific folder in Resize directory"""
@@ -20,9 +22,50 @@ def create_user_folder(chat_id, base_path):
 def cleanup_user_data(chat_id, user_settings):
     """Clean up user data and temporary files"""
     if chat_id in user_settings:
-        if 'original_path' in user_settings[chat_id]:
+        for original_path in user_settings[chat_id].get('original_paths', []):
             try:
-                os.remove(user_settings[chat_id]['original_path'])
+                os.remove(original_path)
             except:
                 pass
         del user_settings[chat_id]
+
+def fits_in_memory(file_size):
+    """Return True if a file of this size should be kept in memory"""
+    return file_size is not None and file_size <= IN_MEMORY_THRESHOLD
+
+async def download_input(client, media, file_size, file_path, **kwargs):
+    """Download media into a BytesIO if it is small, otherwise to file_path"""
+    if fits_in_memory(file_size):
+        return await client.download_media(media, in_memory=True, **kwargs)
+    return await client.download_media(media, file_name=file_path, **kwargs)
+
+def named_buffer(name, data=b""):
+    """Return a BytesIO with a file name, ready for pyrogram uploads"""
+    buffer = BytesIO(data)
+    buffer.name = name
+    return buffer
+
+def is_buffer(source):
+    """Return True if source is an in-memory buffer rather than a path"""
+    return hasattr(source, "getbuffer")
+
+def source_size(source):
+    """Return the size in bytes of a path or in-memory buffer"""
+    if is_buffer(source):
+        return source.getbuffer().nbytes
+    return os.path.getsize(source)
+
+def spill_to_disk(buffer, file_path):
+    """Write an in-memory buffer to file_path and return the path"""
+    with open(file_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return file_path
+
+def source_exists(source):
+    """Return True if source is a buffer or an existing file"""
+    return source is not None and (is_buffer(source) or os.path.exists(source))
+
+def remove_source(source):
+    """Delete source from disk if it is a path; buffers are just dropped"""
+    if source and not is_buffer(source) and os.path.exists(source):
+        os.remove(source)
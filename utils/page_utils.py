@@ -0,0 +1,81 @@
+"""
+Page selection parsing shared by the PDF commands
+"""
+
+class PageSelectionError(ValueError):
+    """Raised for page selections that cannot be parsed or fall outside the document"""
+
+def parse_page_spec(spec):
+    """Parse '1-5,9,20-' into 1-based (start, end) ranges; end is None for open ranges"""
+    ranges = []
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = part.split('-', 1)
+                start = int(start) if start else 1
+                end = int(end) if end else None
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise PageSelectionError(f"'{part}' is not a page number or range")
+        if start < 1 or (end is not None and end < start):
+            raise PageSelectionError(f"'{part}' is not a valid page range")
+        ranges.append((start, end))
+    if not ranges:
+        raise PageSelectionError("no pages selected")
+    return ranges
+
+def parse_page_command(args):
+    """Parse command arguments into (ranges, chunk_size, remaining_args).
+
+    Accepts an optional page selection ('1-5,9,20-') and an optional chunk
+    mode ('every 10'), in any order. Unrecognised words are returned in
+    remaining_args for the caller to interpret.
+    """
+    ranges = None
+    chunk_size = None
+    remaining = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg.lower() == 'every':
+            if not args or not args[0].isdigit() or int(args[0]) < 1:
+                raise PageSelectionError("'every' must be followed by a positive page count")
+            chunk_size = int(args.pop(0))
+        elif arg[:1].isdigit() or arg[:1] == '-':
+            if ranges is not None:
+                raise PageSelectionError("only one page selection is allowed")
+            ranges = parse_page_spec(arg)
+        else:
+            remaining.append(arg)
+    return ranges, chunk_size, remaining
+
+def resolve_pages(ranges, total_pages):
+    """Return the selected 0-based page indices in order, without duplicates"""
+    if ranges is None:
+        return list(range(total_pages))
+    pages = []
+    seen = set()
+    for start, end in ranges:
+        if start > total_pages:
+            raise PageSelectionError(f"page {start} is beyond the last page ({total_pages})")
+        end = total_pages if end is None else min(end, total_pages)
+        for page in range(start - 1, end):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    return pages
+
+def chunk_pages(pages, chunk_size):
+    """Group page indices into consecutive chunks of chunk_size"""
+    return [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)]
+
+def describe_pages(pages):
+    """Return a compact 1-based label for a group of page indices, e.g. '3' or '1-10'"""
+    if len(pages) == 1:
+        return str(pages[0] + 1)
+    if pages == list(range(pages[0], pages[-1] + 1)):
+        return f"{pages[0] + 1}-{pages[-1] + 1}"
+    return ",".join(str(page + 1) for page in pages)
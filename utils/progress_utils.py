@@ -0,0 +1,209 @@
+"""
+Throttled progress messages with smoothed speed and ETA
+"""
+import asyncio
+import logging
+import time
+import weakref
+from pyrogram.errors import FloodWait, MessageNotModified
+from config.settings import STATUS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Reporters that have not finished yet, and counters for /metrics
+_active = weakref.WeakSet()
+totals = {'edits': 0, 'skipped': 0, 'flood_waits': 0, 'finished': 0}
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} TB"
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+def progress_bar(fraction, width=10):
+    completed = min(width, int(fraction * width))
+    return f"[{'█' * completed}{'░' * (width - completed)}]"
+
+class ProgressReporter:
+    """Keep one status message up to date without flooding the API.
+
+    Updates are coalesced: an edit goes out at most every `interval` seconds
+    and only once progress has moved by `min_delta` of the total; the latest
+    update is always delivered by a trailing edit, and edits that would not
+    change the text are skipped. Speed is an exponential moving average and
+    the ETA is derived from it. A FloodWait only postpones the next edit, it
+    never delays the transfer being reported.
+
+    `update` has pyrogram's progress signature, so `progress=reporter.update`
+    can be passed straight to download/upload calls.
+    """
+
+    def __init__(self, message, action, total=0, unit='bytes', interval=STATUS_INTERVAL,
+                 min_delta=0.01, smoothing=0.3, formatter=None):
+        self.message = message
+        self.action = action
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.min_delta = min_delta
+        self.smoothing = smoothing
+        self.formatter = formatter
+        self.extra = None
+        self.current = 0
+        self.speed = None
+        self.started = time.monotonic()
+        self._sample = (self.started, 0)
+        self._last_edit = 0
+        self._last_reported = None
+        self._last_text = getattr(message, 'text', None)
+        self._next_allowed = 0
+        self._trailing = None
+        self._finished = False
+        self._lock = asyncio.Lock()
+        _active.add(self)
+
+    async def update(self, current, total=None, action=None, extra=None, force=False):
+        """Record progress and edit the message if the throttle allows it"""
+        if self._finished:
+            return
+        if total:
+            self.total = total
+        if action is not None:
+            self.action = action
+        if extra is not None:
+            self.extra = extra
+        self._measure(current)
+
+        now = time.monotonic()
+        if not force:
+            moved = self._last_reported is None or not self.total or (
+                abs(current - self._last_reported) >= self.min_delta * self.total
+            )
+            wait = max(self._last_edit + self.interval, self._next_allowed) - now
+            if wait > 0 or not moved:
+                totals['skipped'] += 1
+                self._schedule_trailing(max(wait, self.interval if not moved else 0))
+                return
+        await self._edit()
+
+    async def finish(self, text=None):
+        """Show the final state (or text) and stop reporting"""
+        self.stop()
+        await self._edit(text)
+
+    def stop(self):
+        """Stop reporting without a final edit, e.g. before the message moves on to another stage"""
+        if self._finished:
+            return
+        self._finished = True
+        if self._trailing is not None:
+            self._trailing.cancel()
+        _active.discard(self)
+        totals['finished'] += 1
+
+    def render(self):
+        """Default message text; `formatter(reporter)` replaces it when given"""
+        if self.formatter is not None:
+            return self.formatter(self)
+        return self.render_default()
+
+    def render_default(self):
+        """Action, bar, amounts, speed and ETA; formatters can build on it"""
+        lines = [self.action]
+        if self.total:
+            fraction = self.current / self.total
+            lines.append(f"{progress_bar(fraction)} {fraction * 100:.1f}%")
+        if self.unit == 'bytes':
+            amount = format_size(self.current)
+            if self.total:
+                amount += f" / {format_size(self.total)}"
+        else:
+            amount = f"{self.current}/{self.total} {self.unit}" if self.total else f"{self.current} {self.unit}"
+        lines.append(" · ".join(part for part in (
+            amount,
+            f"{self._rate()}/s" if self.speed else None,
+            f"ETA {format_time(self.eta())}" if self.eta() is not None else None,
+        ) if part))
+        if self.extra:
+            lines.append(self.extra)
+        return "\n".join(lines)
+
+    def eta(self):
+        if not self.speed or not self.total or self.current >= self.total:
+            return None
+        return (self.total - self.current) / self.speed
+
+    def stats(self):
+        """Current numbers, as exposed on /metrics"""
+        return {
+            'action': self.action,
+            'unit': self.unit,
+            'current': self.current,
+            'total': self.total,
+            'speed': self.speed or 0,
+            'eta': self.eta(),
+            'elapsed': time.monotonic() - self.started,
+        }
+
+    def _rate(self):
+        if self.unit == 'bytes':
+            return format_size(self.speed)
+        return f"{self.speed:.1f} {self.unit}"
+
+    def _measure(self, current):
+        now = time.monotonic()
+        self.current = current
+        sample_time, sample_value = self._sample
+        elapsed = now - sample_time
+        if elapsed >= 0.5:
+            instant = (current - sample_value) / elapsed
+            if self.speed is None:
+                self.speed = instant
+            else:
+                self.speed = self.smoothing * instant + (1 - self.smoothing) * self.speed
+            self._sample = (now, current)
+
+    def _schedule_trailing(self, delay):
+        if self._trailing is None or self._trailing.done():
+            self._trailing = asyncio.ensure_future(self._edit_later(delay))
+
+    async def _edit_later(self, delay):
+        await asyncio.sleep(max(delay, self._next_allowed - time.monotonic()))
+        self._trailing = None
+        if not self._finished:
+            await self._edit()
+
+    async def _edit(self, text=None):
+        async with self._lock:
+            text = text or self.render()
+            self._last_reported = self.current
+            if text == self._last_text or self.message is None:
+                totals['skipped'] += 1
+                return
+            try:
+                await self.message.edit_text(text)
+                self._last_text = text
+                self._last_edit = time.monotonic()
+                totals['edits'] += 1
+            except MessageNotModified:
+                self._last_text = text
+            except FloodWait as e:
+                wait = e.value if isinstance(e.value, (int, float)) else 1
+                self._next_allowed = time.monotonic() + wait
+                totals['flood_waits'] += 1
+                self._schedule_trailing(wait)
+            except Exception as e:
+                logger.error(f"Error updating progress message: {e}")
+
+def active_reports():
+    """Stats of every reporter that has not finished"""
+    return [reporter.stats() for reporter in list(_active)]
+
+def metrics():
+    """Counters and active reports for the /metrics endpoint"""
+    return {'progress': dict(totals), 'active': active_reports()}
@@ -0,0 +1,139 @@
+"""
+Bounded per-chat session storage with TTL expiry and LRU eviction
+"""
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from config.settings import SESSION_TTL, SESSION_MAX_ENTRIES, SESSION_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+_stores = weakref.WeakSet()
+_lock = threading.RLock()
+
+class SessionStore:
+    """Dict-like mapping of chat_id -> session with bounded lifetime.
+
+    Entries expire `ttl` seconds after their last access. Each store holds at
+    most `max_entries` sessions, and all stores together hold at most
+    SESSION_MAX_BYTES as reported by `sizeof`; the least recently used
+    session is evicted first. `on_evict(key, value)` runs for sessions that
+    expire or are evicted, but not for ones removed explicitly with del/pop.
+    """
+
+    def __init__(self, name, ttl=SESSION_TTL, max_entries=SESSION_MAX_ENTRIES,
+                 on_evict=None, sizeof=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.sizeof = sizeof
+        # key -> [value, last_access, size], ordered from least to most recent
+        self._entries = OrderedDict()
+        with _lock:
+            _stores.add(self)
+
+    def __contains__(self, key):
+        sweep_all()
+        return key in self._entries
+
+    def __getitem__(self, key):
+        sweep_all()
+        entry = self._entries[key]
+        self._touch(key, entry)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        with _lock:
+            self._entries[key] = [value, time.monotonic(), 0]
+            self._touch(key, self._entries[key])
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest("entry limit")
+        sweep_all()
+
+    def __delitem__(self, key):
+        with _lock:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        with _lock:
+            if key in self._entries:
+                return self._entries.pop(key)[0]
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def touch(self, key):
+        """Refresh the last-access time and size of a session"""
+        with _lock:
+            if key in self._entries:
+                self._touch(key, self._entries[key])
+
+    def total_size(self):
+        return sum(entry[2] for entry in self._entries.values())
+
+    def sweep(self, now=None):
+        """Evict expired sessions; the oldest entries sit at the front"""
+        now = now if now is not None else time.monotonic()
+        with _lock:
+            while self._entries:
+                key, entry = next(iter(self._entries.items()))
+                if now - entry[1] < self.ttl:
+                    break
+                self._evict(key, "expired")
+
+    def _touch(self, key, entry):
+        entry[1] = time.monotonic()
+        if self.sizeof is not None:
+            try:
+                entry[2] = self.sizeof(entry[0])
+            except Exception as e:
+                logger.error(f"Error sizing session {self.name}/{key}: {e}")
+        self._entries.move_to_end(key)
+
+    def _oldest(self):
+        key, entry = next(iter(self._entries.items()))
+        return key, entry[1]
+
+    def _evict_oldest(self, reason):
+        self._evict(next(iter(self._entries)), reason)
+
+    def _evict(self, key, reason):
+        value = self._entries.pop(key)[0]
+        logger.info(f"Evicting {self.name} session {key} ({reason})")
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.error(f"Error cleaning up {self.name} session {key}: {e}")
+
+def sweep_all():
+    """Expire sessions in every store, then enforce the global byte budget"""
+    now = time.monotonic()
+    with _lock:
+        stores = list(_stores)
+        for store in stores:
+            store.sweep(now)
+        total = sum(store.total_size() for store in stores)
+        while total > SESSION_MAX_BYTES:
+            candidates = [store for store in stores if store._entries]
+            if not candidates:
+                break
+            store = min(candidates, key=lambda s: s._oldest()[1])
+            key = next(iter(store._entries))
+            total -= store._entries[key][2]
+            store._evict(key, "memory budget")
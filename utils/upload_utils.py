@@ -0,0 +1,96 @@
+"""
+Bounded-concurrency uploads with shared FloodWait handling
+"""
+import asyncio
+import logging
+import time
+from pyrogram.errors import FloodWait
+from config.settings import UPLOAD_CONCURRENCY
+from utils.progress_utils import format_size
+
+logger = logging.getLogger(__name__)
+
+class UploadPool:
+    """Run uploads with at most `concurrency` in flight.
+
+    A FloodWait from any call pauses every call made through the pool for
+    the requested time, after which the failed call is retried. Uploads
+    finish in whatever order Telegram completes them; callers that need a
+    strict order should submit one at a time or use concurrency=1.
+    A ProgressReporter, if given, is updated after every finished upload.
+    """
+
+    def __init__(self, concurrency=UPLOAD_CONCURRENCY, max_retries=3, reporter=None):
+        self.max_retries = max_retries
+        self.reporter = reporter
+        self.sent = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._flood_until = 0
+
+    async def submit(self, upload, size=0, label=None, on_done=None):
+        """Wait for a free slot, then run the coroutine function upload() in the background.
+
+        on_done() runs after the upload finishes or finally fails, e.g. to
+        delete the uploaded file.
+        """
+        await self._slots.acquire()
+        task = asyncio.create_task(self._run(upload, size, label, on_done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def call(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs), waiting out and retrying FloodWait errors"""
+        for attempt in range(self.max_retries + 1):
+            delay = self._flood_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await func(*args, **kwargs)
+            except FloodWait as e:
+                if attempt == self.max_retries:
+                    raise
+                wait = e.value if isinstance(e.value, (int, float)) else 1
+                logger.warning(f"FloodWait of {wait}s, pausing uploads")
+                self._flood_until = max(self._flood_until, time.monotonic() + wait)
+
+    async def join(self):
+        """Wait for every submitted upload to finish"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def speed(self):
+        """Average upload speed in bytes per second"""
+        elapsed = time.monotonic() - self.started
+        return self.bytes_sent / elapsed if elapsed > 0 else 0
+
+    async def _run(self, upload, size, label, on_done):
+        try:
+            await self.call(upload)
+            self.sent += 1
+            self.bytes_sent += size
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error uploading {label}: {e}")
+            self.failed += 1
+            self.errors.append((label, e))
+        finally:
+            self._slots.release()
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception as e:
+                    logger.error(f"Error after uploading {label}: {e}")
+        if self.reporter is not None:
+            extra = f"{format_size(self.speed())}/s" + (f", {self.failed} failed" if self.failed else "")
+            await self.reporter.update(self.sent + self.failed, extra=extra)
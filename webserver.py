@@ -1,6 +1,7 @@
-from flask import Flask
+from flask import Flask, jsonify
 from threading import Thread
 import logging
+from utils.progress_utils import metrics
 
 app = Flask(__name__)
 
@@ -8,6 +9,10 @@ app = Flask(__name__)
 def home():
     return "running."
 
+@app.route('/metrics')
+def progress_metrics():
+    return jsonify(metrics())
+
 # Start Flask web server
 def run_flask():
     app.run(host='0.0.0.0', port=5018)